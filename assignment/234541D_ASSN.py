@@ -19,21 +19,125 @@
     # 13. Trees to replace the current list or dictionary used for storing books with a Binary Search Tree (BST) for efficient search, insertion, and deletion operations.
 
 
+import argparse
+import asyncio
+import atexit
+import bisect
+import csv
+import gc
+import heapq
+import itertools
+import json
 import logging
+import math
+import mmap
+import operator
+import os
+import pickle
 import shelve
+import sqlite3
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+from array import array
+from collections import deque
+from abc import ABC, abstractmethod
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
 from tabulate import tabulate
 import random
 import string
 import re  # for email validation
 
+try:
+    import numpy as np  # optional, only needed for the columnar catalog reports
+except ImportError:
+    np = None
+
+try:
+    import fcntl  # POSIX advisory file locks, only needed for the shared store mode
+except ImportError:
+    fcntl = None
+
 # Configure logging
 logging.basicConfig(filename='book_management.log', level=logging.INFO,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Write-ahead log tuning: fsync the log at least every WAL_COMMIT_INTERVAL seconds or every WAL_COMMIT_BATCH
+# records, and checkpoint logged writes into shelve every CHECKPOINT_INTERVAL seconds
+WAL_COMMIT_INTERVAL = 0.2
+WAL_COMMIT_BATCH = 64
+CHECKPOINT_INTERVAL = 5.0
+
+# Default customer request service order ('fifo' or 'priority'). A librarian can switch a queue to priority
+# with option 7 of the customer requests menu, and the choice is saved with the queue. In priority mode a
+# tier B request is served ahead of requests that arrived up to PRIORITY_AGING_WINDOW positions before it
+# (tier A: twice that); older ones still win.
+REQUEST_QUEUE_MODE = 'fifo'
+PRIORITY_AGING_WINDOW = 50
+
+# Rows shown per page by the paginated listings
+PAGE_SIZE = 20
+
+# Books written to the store per batch by the bulk import
+IMPORT_BATCH = 10000
+
+# Rows per file written by the exporter
+EXPORT_CHUNK_ROWS = 100000
+
+# Set LIBRARY_SHARED_STORE=1 when several processes (terminals or services) use the same database files at
+# once. Every process must then run in this mode.
+STORE_SHARED = os.environ.get('LIBRARY_SHARED_STORE') == '1'
+
+# Commands that only read the database open it read-only, so they can run next to a live terminal or
+# service: no write-ahead log replay, checkpoints, seeding or catalog file rewrite
+READ_ONLY_COMMANDS = ('export',)
+STORE_READ_ONLY = __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] in READ_ONLY_COMMANDS
+
+# Storage backend under LibraryStore: 'shelve' (the book_management_db dbm files) or 'sqlite'
+# (book_management_db.sqlite). Existing data is moved between them with the migrate-store command.
+STORAGE_BACKEND = os.environ.get('LIBRARY_STORAGE', 'shelve')
+
+# Per-book and per-user locks in the service layer are shared out from this many stripes each, and the
+# network service runs requests on SERVICE_WORKERS threads
+LOCK_STRIPES = 64
+SERVICE_WORKERS = 8
+
+
+################################ class SlottedRecord #######################################
+
+# Base for the compact record classes. They declare __slots__, so instances carry no per-object
+# __dict__. Pickled state is a plain {attribute: value} dict, and __setstate__ also accepts the
+# __dict__ state of records pickled before the classes had slots, so existing shelve data still loads.
+# STATE_DEFAULTS fills attributes that older records were saved without.
+class SlottedRecord:
+    __slots__ = ()
+    STATE_DEFAULTS = {}
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())
+                if hasattr(self, name)}
+
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # (__dict__, slot values) as written by the default slots pickling
+            dict_state, slot_state = state
+            state = {**(dict_state or {}), **(slot_state or {})}
+        for name, value in {**self.STATE_DEFAULTS, **state}.items():
+            setattr(self, name, value)
+
+
+################################ end class SlottedRecord #######################################
+
 
 ################################ class User #######################################
 
-class User:
+class User(SlottedRecord):
+    __slots__ = ('username', 'password', 'role', 'email', 'points', 'tier', 'customer_id')
+
     def __init__(self, username, password, role, customer_id=None, email=None, points=0):
         self.username = username
         self.password = password
@@ -42,7 +146,7 @@ class User:
         self.points = points if role != "customer" else 0  # Set points to 0 for customers
         self.tier = self.determine_tier()
         if role == "customer":
-            self.customer_id = ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+            self.customer_id = customer_id or ''.join(random.choices(string.ascii_letters + string.digits, k=6))
         else:
             self.customer_id = None
 
@@ -70,6 +174,57 @@ class User:
 ################################### End class User ###########################################
 
 
+################################## class UserDirectory ############################################
+# In-memory set of users with hash indexes on username and customer_id, so login, account checks and
+# customer request entry are O(1) instead of scanning every user.
+class UserDirectory:
+    def __init__(self, users=()):
+        self.by_username = {}
+        self.by_customer_id = {}
+        for user in users:
+            self.add(user)
+
+    def __iter__(self):
+        return iter(list(self.by_username.values()))
+
+    def __len__(self):
+        return len(self.by_username)
+
+    def __contains__(self, username):
+        return username in self.by_username
+
+    def add(self, user):
+        self.by_username[user.username] = user
+        customer_id = getattr(user, 'customer_id', None)
+        if customer_id:
+            self.by_customer_id[customer_id] = user
+
+    def remove(self, user):
+        self.by_username.pop(user.username, None)
+        customer_id = getattr(user, 'customer_id', None)
+        if customer_id and self.by_customer_id.get(customer_id) is user:
+            del self.by_customer_id[customer_id]
+
+    def get(self, username):
+        return self.by_username.get(username)
+
+    def get_by_customer_id(self, customer_id):
+        return self.by_customer_id.get(customer_id)
+
+    def customer_ids(self):
+        return self.by_customer_id.keys()
+
+    # Replaces the whole directory, e.g. when undoing "delete all users"
+    def reset(self, users):
+        self.by_username.clear()
+        self.by_customer_id.clear()
+        for user in users:
+            self.add(user)
+
+
+################################## end class UserDirectory ############################################
+
+
 ################################## class MenuItem ############################################
 
 class MenuItem:
@@ -82,7 +237,11 @@ class MenuItem:
 
 
 ################################## class Book ############################################
-class Book:
+class Book(SlottedRecord):
+    __slots__ = ('_title', '_isbn', '_publisher', '_language', '_noOfCopies', '_availability', '_author', '_genre',
+                 '_points_value')
+    STATE_DEFAULTS = {'_points_value': 0}
+
     def __init__(self, ISBN_Num, title, Publisher, Language, NumberOfCopies, Availability, author, genre,
                  points_value=None):
         self._title = title
@@ -159,56 +318,153 @@ class Stack:
 
 
 ################################## class BSTNode and BinarySearchTree ############################################
+# Nodes built from a sorted ISBN table start out lazy: a child is kept as a pending (isbns, lo, hi) range
+# until it is first reached, and the book is only loaded (through book_loader) when it is first read.
 class BSTNode:
-    def __init__(self, book):
-        self.left = None
-        self.right = None
-        self.book = book
+    __slots__ = ('_left', '_right', '_book', 'key', 'height')
+    book_loader = None  # isbn -> Book for lazily built nodes
+    build_lock = threading.Lock()  # two threads must not both materialise the same pending child
 
+    def __init__(self, book):
+        self._left = None
+        self._right = None
+        self._book = book
+        self.key = book.get_isbn()
+        self.height = 1
+
+    # Root of the balanced subtree over isbns[lo:hi]; its children are built on first access
+    @classmethod
+    def from_range(cls, isbns, lo, hi):
+        node = cls.__new__(cls)
+        mid = (lo + hi) // 2
+        node._left = (isbns, lo, mid) if lo < mid else None
+        node._right = (isbns, mid + 1, hi) if mid + 1 < hi else None
+        node._book = None
+        node.key = isbns[mid]
+        node.height = (hi - lo).bit_length()
+        return node
 
+    @property
+    def left(self):
+        if self._left.__class__ is tuple:
+            with BSTNode.build_lock:
+                if self._left.__class__ is tuple:
+                    self._left = BSTNode.from_range(*self._left)
+        return self._left
+
+    @left.setter
+    def left(self, node):
+        self._left = node
+
+    @property
+    def right(self):
+        if self._right.__class__ is tuple:
+            with BSTNode.build_lock:
+                if self._right.__class__ is tuple:
+                    self._right = BSTNode.from_range(*self._right)
+        return self._right
+
+    @right.setter
+    def right(self, node):
+        self._right = node
+
+    @property
+    def book(self):
+        if self._book is None:
+            self._book = BSTNode.book_loader(self.key)
+        return self._book
+
+
+# Self-balancing (AVL) BST keyed on ISBN. ISBNs often arrive in ascending order from publisher feeds,
+# which turns a plain BST into a linked list, so every insert and delete rebalances the path it touched.
 class BinarySearchTree:
     def __init__(self):
         self.root = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def _height(node):
+        return node.height if node else 0
+
+    def _update_height(self, node):
+        node.height = 1 + max(self._height(node.left), self._height(node.right))
+
+    def _balance_factor(self, node):
+        return self._height(node.left) - self._height(node.right)
+
+    def _rotate_right(self, node):
+        pivot = node.left
+        node.left = pivot.right
+        pivot.right = node
+        self._update_height(node)
+        self._update_height(pivot)
+        return pivot
+
+    def _rotate_left(self, node):
+        pivot = node.right
+        node.right = pivot.left
+        pivot.left = node
+        self._update_height(node)
+        self._update_height(pivot)
+        return pivot
+
+    # Restores the AVL invariant at node and returns the new subtree root
+    def _rebalance(self, node):
+        self._update_height(node)
+        balance = self._balance_factor(node)
+        if balance > 1:
+            if self._balance_factor(node.left) < 0:
+                node.left = self._rotate_left(node.left)
+            return self._rotate_right(node)
+        if balance < -1:
+            if self._balance_factor(node.right) > 0:
+                node.right = self._rotate_right(node.right)
+            return self._rotate_left(node)
+        return node
 
     #Inserts a book into the BST
     def insert(self, book):
-        if self.root is None:
-            self.root = BSTNode(book)
-        else:
-            self._insert(self.root, book)
+        self.root = self._insert(self.root, book)
+        self.count += 1
 
-    #Helper method for insertion.
+    #Helper method for insertion. Recursion depth is bounded by the tree height (~1.44 log2 n).
     def _insert(self, node, book):
-        if book.get_isbn() < node.book.get_isbn():
-            if node.left is None:
-                node.left = BSTNode(book)
-            else:
-                self._insert(node.left, book)
+        if node is None:
+            return BSTNode(book)
+        if book.get_isbn() < node.key:
+            node.left = self._insert(node.left, book)
         else:
-            if node.right is None:
-                node.right = BSTNode(book)
-            else:
-                self._insert(node.right, book)
+            node.right = self._insert(node.right, book)
+        return self._rebalance(node)
 
-    def search(self, isbn):
-        return self._search(self.root, isbn)
+    # Replaces the tree with a balanced one over an ISBN-sorted sequence without touching the books. Only
+    # the root is created here; nodes are built and books loaded as searches and traversals reach them.
+    def build_lazy(self, isbns, book_loader):
+        BSTNode.book_loader = book_loader
+        self.root = BSTNode.from_range(isbns, 0, len(isbns)) if len(isbns) else None
+        self.count = len(isbns)
 
-    def _search(self, node, isbn):
-        if node is None or node.book.get_isbn() == isbn:
-            return node
-        if isbn < node.book.get_isbn():
-            return self._search(node.left, isbn)
-        return self._search(node.right, isbn)
+    def search(self, isbn):
+        node = self.root
+        while node is not None and node.key != isbn:
+            node = node.left if isbn < node.key else node.right
+        return node
 
     def delete(self, isbn):
+        if self.search(isbn) is None:
+            return
         self.root = self._delete(self.root, isbn)
+        self.count -= 1
 
     def _delete(self, node, isbn):
         if node is None:
             return node
-        if isbn < node.book.get_isbn():
+        if isbn < node.key:
             node.left = self._delete(node.left, isbn)
-        elif isbn > node.book.get_isbn():
+        elif isbn > node.key:
             node.right = self._delete(node.right, isbn)
         else:
             if node.left is None:
@@ -217,9 +473,17 @@ class BinarySearchTree:
                 return node.left
 
             temp = self._min_value_node(node.right)
-            node.book = temp.book
-            node.right = self._delete(node.right, temp.book.get_isbn())
-        return node
+            node._book = temp._book
+            node.key = temp.key
+            node.right = self._delete_min(node.right)
+        return self._rebalance(node)
+
+    # Removes the leftmost node of a subtree (the in-order successor used in deletion)
+    def _delete_min(self, node):
+        if node.left is None:
+            return node.right
+        node.left = self._delete_min(node.left)
+        return self._rebalance(node)
 
     #  Finds the node with the minimum value (used in deletion)
     def _min_value_node(self, node):
@@ -230,57 +494,1720 @@ class BinarySearchTree:
 
     # Performs an in-order traversal of the BST.
     def inorder_traversal(self):
-        self._inorder_traversal(self.root)
-
-    # Helper method for in-order traversal
-    def _inorder_traversal(self, node):
-        if node:
-            self._inorder_traversal(node.left)
-            print(node.book.get_isbn(), end=' ')
-            self._inorder_traversal(node.right)
+        for book in self.iter_inorder():
+            print(book.get_isbn(), end=' ')
+
+    def __iter__(self):
+        return self.iter_inorder()
+
+    # Yields every book in ISBN order. Uses an explicit stack of at most tree-height nodes, so it
+    # streams without recursion and without copying the catalog into a list.
+    def iter_inorder(self):
+        return self.iter_from(None)
+
+    # Yields every ISBN in order without loading any book. Subtrees still pending from build_lazy are
+    # read straight from their ISBN range instead of being built.
+    def iter_keys(self):
+        stack = []
+        node = self.root
+        while stack or node is not None:
+            if node is None:
+                node = stack.pop()
+                yield node.key
+                node = node._right
+            elif node.__class__ is tuple:
+                isbns, lo, hi = node
+                yield from isbns[lo:hi]
+                node = None
+            else:
+                stack.append(node)
+                node = node._left
+
+    # Cursor that yields books with ISBN >= isbn in ascending order (all books when isbn is None)
+    def iter_from(self, isbn):
+        stack = []
+        node = self.root
+        while node is not None:
+            if isbn is None or node.key >= isbn:
+                stack.append(node)
+                node = node.left
+            else:
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            yield node.book
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    # Yields books with lo_isbn <= ISBN <= hi_isbn in ascending order
+    def iter_range(self, lo_isbn, hi_isbn):
+        for book in self.iter_from(lo_isbn):
+            if book.get_isbn() > hi_isbn:
+                return
+            yield book
 
 
 ################################## end class BSTNode and BinarySearchTree ############################################
 
+################################## class SortedIndex and CatalogIndexes ############################################
+# Secondary index that keeps (key, isbn) pairs in sorted order with bisect, so a sorted view is a
+# linear read instead of an O(n log n) sort per request. The ISBN breaks ties, which keeps equal keys
+# in ISBN order like the old stable sorts over the in-order traversal.
+class SortedIndex:
+    def __init__(self, key_func):
+        self.key_func = key_func
+        self.entries = []  # sorted (key, isbn)
+        self.keys = {}  # isbn -> entry currently indexed, needed to find it again after the book changes
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return (isbn for key, isbn in self.entries)
+
+    def add(self, book):
+        entry = (self.key_func(book), book.get_isbn())
+        bisect.insort(self.entries, entry)
+        self.keys[entry[1]] = entry
+
+    # Adds many books with a single sort instead of one insort each
+    def add_many(self, books):
+        for book in books:
+            entry = (self.key_func(book), book.get_isbn())
+            self.entries.append(entry)
+            self.keys[entry[1]] = entry
+        self.entries.sort()
+
+    def discard(self, isbn):
+        entry = self.keys.pop(isbn, None)
+        if entry is not None:
+            del self.entries[bisect.bisect_left(self.entries, entry)]
+
+
+# Keeps every registered secondary index in step with the catalog on insert, update and delete
+class CatalogIndexes:
+    def __init__(self, books):
+        self.books = books  # isbn -> Book, i.e. booklist
+        self.indexes = {}  # built indexes, kept in step with the catalog
+        self.unbuilt = {}  # registered indexes that have not been used yet
+
+    # Indexes are built from the catalog the first time they are used, not at startup
+    def register(self, name, index):
+        self.unbuilt[name] = index
+
+    def get(self, name):
+        if name in self.unbuilt:
+            index = self.unbuilt.pop(name)
+            self._add_many(index, self.books.values())
+            self.indexes[name] = index
+        return self.indexes[name]
+
+    def add(self, book):
+        for index in self.indexes.values():
+            index.add(book)
+
+    # Bulk insert; indexes that provide add_many build in one pass, the rest take the books one by one
+    def add_many(self, books):
+        for index in self.indexes.values():
+            self._add_many(index, books)
+
+    @staticmethod
+    def _add_many(index, books):
+        if hasattr(index, 'add_many'):
+            index.add_many(books)
+        else:
+            for book in books:
+                index.add(book)
+
+    def discard(self, isbn):
+        for index in self.indexes.values():
+            index.discard(isbn)
+
+    # Re-indexes a book whose fields changed (or which was replaced under the same ISBN)
+    def update(self, book):
+        self.discard(book.get_isbn())
+        self.add(book)
+
+    # Books in the order kept by the named index
+    def ordered_books(self, name):
+        return (self.books[isbn] for isbn in self.get(name))
+
+
+################################## end class SortedIndex and CatalogIndexes ############################################
+
+
+################################## class InvertedIndex ############################################
+# Full-text index over title, author, publisher and genre. Maps each lowercased token to the books that
+# contain it with a field weight (a title hit counts more than a genre hit). A sorted vocabulary allows
+# prefix lookups. Queries AND all terms together, treating each one as a prefix. Results are ranked by
+# weight times inverse document frequency, and a whole-word match outranks a prefix-only match.
+class InvertedIndex:
+    FIELD_WEIGHTS = (('get_title', 3.0), ('get_author', 2.0), ('get_publisher', 1.0), ('get_genre', 1.0))
+    PREFIX_MATCH_FACTOR = 0.5
+
+    def __init__(self):
+        self.postings = {}  # token -> {isbn: weight}
+        self.vocabulary = []  # sorted tokens
+        self.book_tokens = {}  # isbn -> tokens indexed for that book
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r"[a-z0-9]+", str(text).lower())
+
+    def add(self, book):
+        for token in self._post(book):
+            bisect.insort(self.vocabulary, token)
+
+    # Adds many books and re-sorts the vocabulary once instead of one insort per new token
+    def add_many(self, books):
+        new_tokens = [token for book in books for token in self._post(book)]
+        if new_tokens:
+            self.vocabulary.extend(new_tokens)
+            self.vocabulary.sort()
+
+    # Records the book's postings and returns the tokens that were not in the vocabulary yet
+    def _post(self, book):
+        isbn = book.get_isbn()
+        weights = {}
+        for getter, weight in self.FIELD_WEIGHTS:
+            for token in self.tokenize(getattr(book, getter)()):
+                weights[token] = weights.get(token, 0) + weight
+        new_tokens = []
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self.postings[token] = {}
+                new_tokens.append(token)
+            self.postings[token][isbn] = weight
+        self.book_tokens[isbn] = list(weights)
+        return new_tokens
+
+    def discard(self, isbn):
+        for token in self.book_tokens.pop(isbn, ()):
+            books = self.postings[token]
+            books.pop(isbn, None)
+            if not books:
+                del self.postings[token]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, token)]
+
+    # isbn -> score for one query term, counting every vocabulary token that starts with it
+    def _term_scores(self, term):
+        scores = {}
+        position = bisect.bisect_left(self.vocabulary, term)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(term):
+            token = self.vocabulary[position]
+            books = self.postings[token]
+            factor = 1.0 if token == term else self.PREFIX_MATCH_FACTOR
+            idf = math.log(1 + len(self.book_tokens) / len(books))
+            for isbn, weight in books.items():
+                score = weight * factor * idf
+                if score > scores.get(isbn, 0):
+                    scores[isbn] = score
+            position += 1
+        return scores
+
+    # ISBNs of books matching every term of the query, best match first
+    def search(self, query, limit=None):
+        terms = self.tokenize(query)
+        if not terms:
+            return []
+        per_term = sorted((self._term_scores(term) for term in dict.fromkeys(terms)), key=len)
+        ranked = dict(per_term[0])
+        for scores in per_term[1:]:
+            ranked = {isbn: score + scores[isbn] for isbn, score in ranked.items() if isbn in scores}
+            if not ranked:
+                return []
+        # With a limit only the best few are kept in a heap, so a short prefix query over a large catalog
+        # does not sort every match
+        if limit is None:
+            return sorted(ranked, key=lambda isbn: (-ranked[isbn], isbn))
+        return heapq.nsmallest(limit, ranked, key=lambda isbn: (-ranked[isbn], isbn))
+
+
+################################## end class InvertedIndex ############################################
+
+
+################################## class TrigramIndex ############################################
+# Typo-tolerant title lookup. Each lowercased title is split into padded character trigrams and the
+# index maps trigram -> ISBNs. One edit changes at most 3 trigrams, so a title within edit distance k of
+# the query lacks at most 3k of the query's trigrams: it must contain one of any 3k + 1 of them, and share
+# at least (query trigrams - 3k) in all. Candidates therefore come from the postings of the 3k + 1 rarest
+# query trigrams only (prefix filtering), or from the titles within k characters of the query's length
+# when those are fewer (e.g. short queries made of common trigrams). They are then cut by title length
+# and by that shared count before the exact, early-exit edit distance. A query with at most 3k trigrams
+# may share none with a match ("ab" and "xb"), so its candidates are all the titles of a similar length.
+class TrigramIndex:
+    def __init__(self):
+        self.postings = {}  # trigram -> set of isbns
+        self.titles = {}  # isbn -> lowercased title
+        self.lengths = {}  # title length -> set of isbns
+
+    @staticmethod
+    def trigrams(text):
+        padded = f"  {text} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def add(self, book):
+        isbn = book.get_isbn()
+        title = str(book.get_title()).lower()
+        self.titles[isbn] = title
+        self.lengths.setdefault(len(title), set()).add(isbn)
+        for trigram in self.trigrams(title):
+            self.postings.setdefault(trigram, set()).add(isbn)
+
+    def discard(self, isbn):
+        title = self.titles.pop(isbn, None)
+        if title is None:
+            return
+        same_length = self.lengths[len(title)]
+        same_length.discard(isbn)
+        if not same_length:
+            del self.lengths[len(title)]
+        for trigram in self.trigrams(title):
+            books = self.postings[trigram]
+            books.discard(isbn)
+            if not books:
+                del self.postings[trigram]
+
+    # Levenshtein distance, giving up with limit + 1 as soon as it must exceed limit
+    @staticmethod
+    def edit_distance(source, target, limit):
+        if abs(len(source) - len(target)) > limit:
+            return limit + 1
+        previous = list(range(len(target) + 1))
+        for i, source_char in enumerate(source, start=1):
+            current = [i]
+            for j, target_char in enumerate(target, start=1):
+                current.append(min(previous[j] + 1, current[j - 1] + 1,
+                                   previous[j - 1] + (source_char != target_char)))
+            if min(current) > limit:
+                return limit + 1
+            previous = current
+        return previous[-1]
+
+    # (isbn, distance) for titles within max_distance edits of the query, closest first
+    def search(self, query, max_distance=None, limit=10):
+        query = query.lower().strip()
+        if not query:
+            return []
+        if max_distance is None:
+            max_distance = max(1, min(3, len(query) // 4))
+        query_trigrams = self.trigrams(query)
+        postings = sorted((self.postings.get(trigram, ()) for trigram in query_trigrams), key=len)
+        lengths = [self.lengths.get(length, ()) for length in
+                   range(len(query) - max_distance, len(query) + max_distance + 1)]
+        threshold = len(query_trigrams) - 3 * max_distance
+        if threshold <= 0:
+            candidates = set().union(*lengths)
+        else:
+            prefix = postings[:3 * max_distance + 1]
+            if sum(map(len, lengths)) < sum(map(len, prefix)):
+                prefix = lengths
+            candidates = set().union(*prefix)
+        matches = []
+        for isbn in candidates:
+            title = self.titles[isbn]
+            if abs(len(title) - len(query)) > max_distance:
+                continue
+            count = sum(isbn in books for books in postings)
+            if count < threshold:
+                continue
+            distance = self.edit_distance(query, title, max_distance)
+            if distance <= max_distance:
+                matches.append((distance, -count, isbn))
+        matches.sort()
+        return [(isbn, distance) for distance, count, isbn in matches[:limit]]
+
+
+################################## end class TrigramIndex ############################################
+
+
+################################## class CatalogColumns ############################################
+# Optional NumPy column store mirroring the catalog for reporting. ISBN, copies, availability and
+# points are numeric arrays. Publisher, language and genre are dictionary-encoded into integer codes.
+# It is registered with CatalogIndexes, so it stays in sync with the tree. Deleting a book moves the
+# last row into its slot, so the arrays stay dense and filters and aggregates are single vectorized passes.
+class CatalogColumns:
+    NUMERIC_COLUMNS = {'isbn': 'int64', 'copies': 'int64', 'available': 'bool', 'points': 'int64'}
+    ENCODED_COLUMNS = {'publisher': 'get_publisher', 'language': 'get_language', 'genre': 'get_genre'}
+
+    def __init__(self, capacity=1024):
+        if np is None:
+            raise ImportError("The columnar catalog snapshot needs NumPy (pip install numpy).")
+        self.size = 0
+        self.rows = {}  # isbn -> row
+        self.arrays = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.NUMERIC_COLUMNS.items()}
+        self.arrays.update({name: np.zeros(capacity, dtype='int32') for name in self.ENCODED_COLUMNS})
+        self.dictionaries = {name: [] for name in self.ENCODED_COLUMNS}  # code -> value
+        self.codes = {name: {} for name in self.ENCODED_COLUMNS}  # value -> code
+
+    def __len__(self):
+        return self.size
+
+    def _encode(self, column, value):
+        codes = self.codes[column]
+        if value not in codes:
+            codes[value] = len(self.dictionaries[column])
+            self.dictionaries[column].append(value)
+        return codes[value]
+
+    def _grow(self):
+        for name, array in self.arrays.items():
+            grown = np.zeros(len(array) * 2, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            self.arrays[name] = grown
+
+    def add(self, book):
+        if self.size == len(self.arrays['isbn']):
+            self._grow()
+        row = self.size
+        self.arrays['isbn'][row] = book.get_isbn()
+        self.arrays['copies'][row] = book.get_noOfCopies()
+        self.arrays['available'][row] = book.get_availability() == "Yes"
+        self.arrays['points'][row] = book.get_points_value()
+        for column, getter in self.ENCODED_COLUMNS.items():
+            self.arrays[column][row] = self._encode(column, getattr(book, getter)())
+        self.rows[book.get_isbn()] = row
+        self.size += 1
+
+    def discard(self, isbn):
+        row = self.rows.pop(isbn, None)
+        if row is None:
+            return
+        last = self.size - 1
+        if row != last:
+            for array in self.arrays.values():
+                array[row] = array[last]
+            self.rows[int(self.arrays['isbn'][row])] = row
+        self.size -= 1
+
+    def column(self, name):
+        return self.arrays[name][:self.size]
+
+    # Boolean row mask for equality conditions, e.g. mask(copies=0) or mask(publisher="wakanda", available=True)
+    def mask(self, **conditions):
+        selected = np.ones(self.size, dtype=bool)
+        for name, value in conditions.items():
+            if name in self.ENCODED_COLUMNS:
+                code = self.codes[name].get(value)
+                if code is None:
+                    return np.zeros(self.size, dtype=bool)
+                value = code
+            selected &= self.column(name) == value
+        return selected
+
+    # ISBNs of the rows matching the conditions (see mask)
+    def filter(self, **conditions):
+        return self.column('isbn')[self.mask(**conditions)]
+
+    # {group value: total} of a numeric column summed per value of an encoded column
+    def total_by(self, group_column, value_column='copies', mask=None):
+        codes = self.column(group_column)
+        values = self.column(value_column)
+        if mask is not None:
+            codes, values = codes[mask], values[mask]
+        totals = np.bincount(codes, weights=values, minlength=len(self.dictionaries[group_column]))
+        return {self.dictionaries[group_column][code]: int(total) for code, total in enumerate(totals) if total}
+
+    def zero_copies(self):
+        return self.filter(copies=0)
+
+    # (counts, bin edges) histogram of a numeric column
+    def distribution(self, column='points', bins=10):
+        values = self.column(column)
+        if len(values):
+            bins = max(1, min(bins, int(values.max() - values.min()) + 1))
+        return np.histogram(values, bins=bins)
+
+
+################################## end class CatalogColumns ############################################
+
+
+################################## class WriteAheadLog ############################################
+# Append-only log of store mutations. Records are length-prefixed pickles; fsync is batched (group
+# commit) so a burst of writes shares one disk flush instead of paying one each.
+class WriteAheadLog:
+    HEADER = struct.Struct('<I')
+
+    def __init__(self, path, commit_interval, commit_batch):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.commit_batch = commit_batch
+        self.file = open(path, 'ab')
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def append(self, record):
+        data = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        self.file.write(self.HEADER.pack(len(data)) + data)
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_batch or time.monotonic() - self.last_commit >= self.commit_interval:
+            self.commit()
+
+    # Makes every appended record durable with a single fsync
+    def commit(self):
+        if self.uncommitted:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    # Yields the logged records in order, stopping at a torn or corrupt tail left by a crash
+    def replay(self):
+        with open(self.path, 'rb') as log_file:
+            while True:
+                header = log_file.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    return
+                (length,) = self.HEADER.unpack(header)
+                data = log_file.read(length)
+                if len(data) < length:
+                    return
+                try:
+                    yield pickle.loads(data)
+                except (pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+                    return
+
+    # Empties the log once its records have been checkpointed into the main store
+    def truncate(self):
+        self.file.flush()
+        self.file.truncate(0)
+        os.fsync(self.file.fileno())
+        self.uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self.file.close()
+
+
+################################## end class WriteAheadLog ############################################
+
+
+################################## class ChangeJournal ############################################
+# Append-only record of which keys changed at which sequence number, one JSON line [seq, op, key] per
+# mutation. Entries are written when the mutations reach shelve, so exports can pick up only the records
+# changed since a given sequence without scanning or unpickling the whole store.
+class ChangeJournal:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def append(self, entries):
+        if not entries:
+            return
+        self.file.write(''.join(json.dumps(entry) + '\n' for entry in entries))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    # Current end of the journal, including entries appended by other processes
+    def position(self):
+        return os.fstat(self.file.fileno()).st_size
+
+    # Yields (seq, op, key) for entries newer than seq, reading from offset (a position() taken earlier)
+    # and skipping a torn last line
+    def since(self, seq, offset=0):
+        with open(self.path, encoding='utf-8') as journal_file:
+            journal_file.seek(offset)
+            for line in journal_file:
+                try:
+                    entry_seq, op, key = json.loads(line)
+                except ValueError:
+                    continue
+                if entry_seq > seq:
+                    yield entry_seq, op, key
+
+    def close(self):
+        self.file.close()
+
+
+################################## end class ChangeJournal ############################################
+
+
+################################## class StorageBackend ############################################
+# The record files under LibraryStore: a mapping of string keys to pickled values, plus key scans by
+# prefix, lookups and pages on indexed fields, sync and close. LibraryStore keeps the write-ahead log,
+# change journal and shared-mode locking on top, so a backend only has to read and write records.
+class StorageBackend(MutableMapping, ABC):
+    # key prefix -> {field: record attribute} that find() and page() can look records up by
+    INDEXED_FIELDS = {
+        'book:': {'title': '_title', 'publisher': '_publisher'},
+        'user:': {'customer_id': 'customer_id'},
+        'customer_requests:': {'customer_id': 'customer_id'},
+    }
+    # key prefix -> type of the rest of the key, which gives the key order (ISBN, username, arrival position)
+    KEY_TYPES = {'book:': int, 'user:': str, 'customer_requests:': int}
+
+    # Keys starting with prefix, in key order where the backend keeps one
+    @abstractmethod
+    def keys_with_prefix(self, prefix):
+        pass
+
+    # Keys under prefix whose record has field (one of INDEXED_FIELDS[prefix]) equal to value, in key order
+    @abstractmethod
+    def find(self, prefix, field, value):
+        pass
+
+    # Keys under prefix ordered by field (one of INDEXED_FIELDS[prefix]) and then by key, from offset on
+    @abstractmethod
+    def page(self, prefix, field, offset, limit):
+        pass
+
+    @abstractmethod
+    def sync(self):
+        pass
+
+    # stale=True: the files may have been changed by another process since this handle last synced
+    @abstractmethod
+    def close(self, stale=False):
+        pass
+
+
+# The original format: one shelve (dbm) file set, with every key in a single unordered index
+class ShelveBackend(StorageBackend):
+    def __init__(self, path, read_only=False):
+        self.db = shelve.open(path, flag='r' if read_only else 'c')
+
+    def __getitem__(self, key):
+        return self.db[key]
+
+    def __setitem__(self, key, value):
+        self.db[key] = value
+
+    def __delitem__(self, key):
+        del self.db[key]
+
+    def __contains__(self, key):
+        return key in self.db
+
+    def __iter__(self):
+        return iter(self.db.keys())
+
+    def __len__(self):
+        return len(self.db)
+
+    def get(self, key, default=None):
+        return self.db.get(key, default)
+
+    def keys_with_prefix(self, prefix):
+        return [key for key in self.db.keys() if key.startswith(prefix)]
+
+    def _key_order(self, prefix):
+        key_type = self.KEY_TYPES[prefix]
+        return lambda key: key_type(key[len(prefix):])
+
+    # No secondary indexes: unpickles every record under the prefix
+    def find(self, prefix, field, value):
+        attribute = self.INDEXED_FIELDS[prefix][field]
+        return sorted((key for key in self.keys_with_prefix(prefix) if getattr(self.db[key], attribute, None) == value),
+                      key=self._key_order(prefix))
+
+    def page(self, prefix, field, offset, limit):
+        attribute = self.INDEXED_FIELDS[prefix][field]
+        key_order = self._key_order(prefix)
+        values = {key: getattr(self.db[key], attribute, None) for key in self.keys_with_prefix(prefix)}
+        # Missing values first, as SQLite orders NULL
+        ordered = heapq.nsmallest(offset + limit, values,
+                                  key=lambda key: (values[key] is not None, values[key] or '', key_order(key)))
+        return ordered[offset:]
+
+    def sync(self):
+        self.db.sync()
+
+    def close(self, stale=False):
+        # dbm.dumb rewrites its whole index file on close once the handle has ever written, which would
+        # put back a stale view of the files. The handle's own writes are already synced, so skip that.
+        dumb = getattr(self.db, 'dict', None)
+        if stale and getattr(dumb, '_modified', False):
+            dumb._modified = False
+        self.db.close()
+
+
+# SQLite file with a table per record type, so lookups and scans are indexed queries instead of a pass
+# over every key:
+#   books    'book:<isbn>'               isbn primary key, indexed title and publisher
+#   users    'user:<username>'           username primary key, indexed customer_id
+#   requests 'customer_requests:<pos>'   arrival position primary key, indexed (customer_id, position)
+#   meta     any other key (queue pointers, cafe menu, version stamps)
+# Each row also holds the pickled record, so values come back exactly as they were stored. Writes are
+# committed by sync(), which LibraryStore calls at every checkpoint.
+class SQLiteBackend(StorageBackend):
+    # prefix -> (table, key column, key type); the indexed columns are named after INDEXED_FIELDS
+    TABLES = {
+        'book:': ('books', 'isbn', int),
+        'user:': ('users', 'username', str),
+        'customer_requests:': ('requests', 'position', int),
+    }
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS books (isbn INTEGER PRIMARY KEY, title TEXT, publisher TEXT, record BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, customer_id TEXT, record BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS requests (position INTEGER PRIMARY KEY, customer_id TEXT, record BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, record BLOB NOT NULL)",
+    )
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS books_title ON books (title)",
+        "CREATE INDEX IF NOT EXISTS books_publisher ON books (publisher)",
+        "CREATE INDEX IF NOT EXISTS users_customer_id ON users (customer_id)",
+        "CREATE INDEX IF NOT EXISTS requests_customer ON requests (customer_id, position)",
+    )
+    # PRAGMA user_version of files whose indexed columns are filled in for every row
+    SCHEMA_VERSION = 1
+
+    def __init__(self, path, read_only=False):
+        # LibraryStore serialises every call under its own lock, so the connection can move between threads
+        if read_only:
+            uri = f"{Path(f'{path}.sqlite').resolve().as_uri()}?mode=ro"
+            self.conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            return
+        self.conn = sqlite3.connect(f"{path}.sqlite", check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        for statement in self.SCHEMA:
+            self.conn.execute(statement)
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+            self._fill_indexed_columns()
+        for statement in self.INDEXES:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    # Files from before SCHEMA_VERSION may lack the indexed columns, or have them empty for some rows:
+    # adds the missing columns and fills them in from every record, once
+    def _fill_indexed_columns(self):
+        for prefix, (table, column, key_type) in self.TABLES.items():
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            indexed = self.INDEXED_FIELDS[prefix]
+            for field in indexed:
+                if field not in existing:
+                    self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {field} TEXT")
+            rows = self.conn.execute(f"SELECT {column}, record FROM {table}").fetchall()
+            assignments = ', '.join(f"{field} = ?" for field in indexed)
+            self.conn.executemany(f"UPDATE {table} SET {assignments} WHERE {column} = ?",
+                                  ([*self._indexed_values(indexed, pickle.loads(record)), row_key]
+                                   for row_key, record in rows))
+        self.conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    @staticmethod
+    def _indexed_values(indexed, value):
+        return [getattr(value, attribute, None) for attribute in indexed.values()]
+
+    # (table, key column, row key, {indexed column: record attribute}) for a key
+    def _locate(self, key):
+        for prefix, (table, column, key_type) in self.TABLES.items():
+            if key.startswith(prefix):
+                try:
+                    return table, column, key_type(key[len(prefix):]), self.INDEXED_FIELDS[prefix]
+                except ValueError:
+                    break
+        return 'meta', 'key', key, {}
+
+    def __getitem__(self, key):
+        table, column, row_key, _ = self._locate(key)
+        row = self.conn.execute(f"SELECT record FROM {table} WHERE {column} = ?", (row_key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return pickle.loads(row[0])
+
+    def __setitem__(self, key, value):
+        table, column, row_key, indexed = self._locate(key)
+        columns = [column, *indexed, 'record']
+        values = [row_key, *self._indexed_values(indexed, value), pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)]
+        self.conn.execute(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                          f"VALUES ({', '.join('?' * len(columns))})", values)
+
+    def __delitem__(self, key):
+        table, column, row_key, _ = self._locate(key)
+        if self.conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (row_key,)).rowcount == 0:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        table, column, row_key, _ = self._locate(key)
+        return self.conn.execute(f"SELECT 1 FROM {table} WHERE {column} = ?", (row_key,)).fetchone() is not None
+
+    def __iter__(self):
+        for prefix in self.TABLES:
+            yield from self.keys_with_prefix(prefix)
+        yield from (key for (key,) in self.conn.execute("SELECT key FROM meta ORDER BY key"))
+
+    def __len__(self):
+        return sum(self.conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                   for table in ('books', 'users', 'requests', 'meta'))
+
+    def keys_with_prefix(self, prefix):
+        if prefix in self.TABLES:
+            table, column, _ = self.TABLES[prefix]
+            return [f"{prefix}{row_key}" for (row_key,) in
+                    self.conn.execute(f"SELECT {column} FROM {table} ORDER BY {column}")]
+        return [key for key in self if key.startswith(prefix)]
+
+    def find(self, prefix, field, value):
+        table, column, _ = self.TABLES[prefix]
+        if field not in self.INDEXED_FIELDS[prefix]:
+            raise KeyError(field)
+        return [f"{prefix}{row_key}" for (row_key,) in self.conn.execute(
+            f"SELECT {column} FROM {table} WHERE {field} = ? ORDER BY {column}", (value,))]
+
+    def page(self, prefix, field, offset, limit):
+        table, column, _ = self.TABLES[prefix]
+        if field not in self.INDEXED_FIELDS[prefix]:
+            raise KeyError(field)
+        return [f"{prefix}{row_key}" for (row_key,) in self.conn.execute(
+            f"SELECT {column} FROM {table} ORDER BY {field}, {column} LIMIT ? OFFSET ?", (limit, offset))]
+
+    def sync(self):
+        self.conn.commit()
+
+    def close(self, stale=False):
+        self.conn.commit()
+        self.conn.close()
+
+
+STORAGE_BACKENDS = {'shelve': ShelveBackend, 'sqlite': SQLiteBackend}
+
+
+def open_backend(name, path, read_only=False):
+    if name not in STORAGE_BACKENDS:
+        raise IOError(f"Unknown storage backend '{name}' (expected one of: {', '.join(STORAGE_BACKENDS)}).")
+    return STORAGE_BACKENDS[name](path, read_only)
+
+
+################################## end class StorageBackend ############################################
+
+
+################################## class LibraryStore ############################################
+# Per-record storage on top of a StorageBackend (shelve unless STORAGE_BACKEND says otherwise). Every
+# Book is kept under its own 'book:<isbn>' key and every User under 'user:<username>', so a mutation only
+# re-pickles the records it touched instead of the whole 'books' dict or 'users' list. One backend handle
+# is opened per process and shared by every caller; it is flushed and closed at interpreter exit.
+#
+# Mutations are first appended to a write-ahead log (group-committed) and kept in memory; a background
+# thread checkpoints them into shelve. On startup any records left in the log are replayed.
+#
+# In shared mode several processes use the same files. Each session then runs under an exclusive
+# advisory lock on <db>.lock and writes straight through to shelve, syncing when the session ends. The
+# session starts by checking the change journal: if another process wrote since this one last looked,
+# the shelve handle is reopened and the registered listeners get the changed keys so in-memory copies
+# can be refreshed.
+#
+# A process that writes holds <db>.owner for its lifetime: exclusively outside shared mode, shared in it,
+# so a second writer (another terminal, an import) is refused instead of corrupting the files. Writes to
+# the files themselves happen under an exclusive lock on <db>.lock. A read-only store takes neither
+# writer role: each session holds a shared lock on <db>.lock and reopens the files when the journal shows
+# that a writer has checkpointed since.
+class LibraryStore:
+    BOOK_PREFIX = 'book:'
+    USER_PREFIX = 'user:'
+    SEQ_KEY = 'wal_seq'
+    USERS_VERSION_KEY = 'users_version'
+
+    def __init__(self, path='book_management_db', commit_interval=WAL_COMMIT_INTERVAL,
+                 commit_batch=WAL_COMMIT_BATCH, checkpoint_interval=CHECKPOINT_INTERVAL, shared=STORE_SHARED,
+                 backend=STORAGE_BACKEND, read_only=STORE_READ_ONLY):
+        if shared and fcntl is None:
+            raise IOError("The shared store mode needs POSIX file locking (fcntl).")
+        self.path = path
+        self.backend = backend
+        self.checkpoint_interval = checkpoint_interval
+        self.read_only = read_only
+        self.shared = shared and not read_only
+        self.lock = threading.RLock()
+        self.owner_file = None if read_only else self._claim_owner()
+        self.lock_file = open(f"{path}.lock", 'a') if fcntl is not None else None
+        self.locked = False  # whether this process holds the file lock
+        self.listeners = []  # called with {key: op} when a session finds changes made by other processes
+        self.seq = 0
+        self.journal = ChangeJournal(f"{path}.changes")
+        self.journal_seen = self.journal.position()  # journal size when the handle last saw the files
+        self.db = open_backend(backend, path, read_only)
+        self.pending = {}  # key -> (op, value) logged but not yet checkpointed into shelve
+        self.own_users_versions = set()  # users version stamps written by this process, not yet seen by the cache
+        self.unjournaled = []  # (seq, op, key) of mutations not yet checkpointed into shelve
+        with self._session() as db:
+            if read_only and ('books' in db or 'users' in db):
+                raise IOError("The database still uses the old layout; run the program once to upgrade it.")
+            if not read_only:
+                with self._file_lock():
+                    self._migrate_legacy(db)
+            self.seq = db.get(self.SEQ_KEY, 0)
+        self.wal = None if read_only else WriteAheadLog(f"{path}.wal", commit_interval, commit_batch)
+        if not read_only:
+            self._recover()
+        self.last_checkpoint = time.monotonic()
+        self._stop = threading.Event()
+        if not (self.shared or read_only):
+            self._checkpointer = threading.Thread(target=self._run_checkpointer, daemon=True)
+            self._checkpointer.start()
+        atexit.register(self.close)
+
+    # Takes the writer's lock on <db>.owner for the life of the process, or raises IOError when another
+    # process already writes to the database in a way this one cannot share
+    def _claim_owner(self):
+        if fcntl is None:
+            return None
+        owner_file = open(f"{self.path}.owner", 'a')
+        try:
+            fcntl.flock(owner_file, (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+        except OSError:
+            owner_file.close()
+            raise IOError("The book management database is in use by another process. Close it first, or run "
+                          "every process with LIBRARY_SHARED_STORE=1.")
+        return owner_file
+
+    # Holds <db>.lock (exclusive for writes, shared for read-only sessions) unless this thread's session
+    # already does
+    @contextmanager
+    def _file_lock(self, operation=None):
+        if self.lock_file is None or self.locked:
+            yield
+            return
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX if operation is None else operation)
+        self.locked = True
+        try:
+            yield
+        finally:
+            self.locked = False
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    # Yields the shared handle; the lock keeps a single writer on the dbm files at a time. In shared mode
+    # the outermost session also holds the file lock and starts from the other processes' latest writes;
+    # a read-only session does the same under a shared lock.
+    @contextmanager
+    def _session(self):
+        with self.lock:
+            if self.db is None:
+                raise IOError("The book management database has been closed.")
+            if not (self.shared or self.read_only) or self.locked:
+                yield self.db
+                return
+            with self._file_lock(fcntl.LOCK_SH if self.read_only else fcntl.LOCK_EX):
+                try:
+                    self._refresh()
+                    yield self.db
+                finally:
+                    self._commit_shared()
+
+    # Groups the reads and writes of one operation into a single locked session in shared mode, so a
+    # read-check-write cannot interleave with another process. Outside shared mode it does nothing.
+    @contextmanager
+    def transaction(self):
+        if not self.shared:
+            yield
+            return
+        with self._session():
+            yield
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    # Picks up writes made by other processes since this one last held the lock (shared or read-only mode)
+    def _refresh(self):
+        size = self.journal.position()
+        if size == self.journal_seen:
+            return
+        self.db.close(stale=True)
+        self.db = open_backend(self.backend, self.path, self.read_only)
+        changes = {}
+        for seq, op, key in self.journal.since(self.seq, self.journal_seen):
+            changes.pop(key, None)
+            changes[key] = op
+        self.seq = max(self.seq, self.db.get(self.SEQ_KEY, 0))
+        self.journal_seen = size
+        if changes:
+            for listener in self.listeners:
+                listener(changes)
+
+    # Makes the session's writes visible to the other processes (shared mode)
+    def _commit_shared(self):
+        if self.db is None or self.read_only:
+            return
+        if self.unjournaled:
+            self.db[self.SEQ_KEY] = self.seq
+            self.journal.append(self.unjournaled)
+            self.unjournaled.clear()
+            self.db.sync()
+        self.journal_seen = self.journal.position()
+
+    # Splits the old whole-collection keys ('books' dict, 'users' list) into per-record keys
+    def _migrate_legacy(self, db):
+        migrated = False
+        if 'books' in db:
+            for book in db['books'].values():
+                db[self.book_key(book.get_isbn())] = book
+            del db['books']
+            migrated = True
+            logging.info("Migrated 'books' into per-record storage.")
+        if 'users' in db:
+            for user in db['users']:
+                db[self.user_key(user.username)] = user
+            db['users_seeded'] = True
+            del db['users']
+            migrated = True
+            logging.info("Migrated 'users' into per-record storage.")
+        if migrated:
+            db.sync()
+
+    # Replays log records newer than the last checkpoint, e.g. after a crash
+    def _recover(self):
+        replayed = 0
+        with self._session() as db, self._file_lock():
+            for seq, op, event, key, value in self.wal.replay():
+                if seq <= self.seq:
+                    continue
+                self._apply(db, op, key, value)
+                self.seq = seq
+                self.unjournaled.append((seq, op, key))
+                replayed += 1
+            if replayed:
+                db[self.SEQ_KEY] = self.seq
+                self.journal.append(self.unjournaled)
+                self.unjournaled.clear()
+                db.sync()
+            self.wal.truncate()
+        if replayed:
+            logging.info(f"Recovered {replayed} write-ahead log records.")
+
+    @staticmethod
+    def _apply(db, op, key, value):
+        if op == 'put':
+            db[key] = value
+        elif key in db:
+            del db[key]
+
+    def _log(self, op, event, key, value=None):
+        if self.read_only:
+            raise IOError("The book management database is open read-only.")
+        with self._session() as db:
+            self.seq += 1
+            if self.shared:
+                self._apply(db, op, key, value)
+            else:
+                self.wal.append((self.seq, op, event, key, value))
+                self.pending[key] = (op, value)
+            self.unjournaled.append((self.seq, op, key))
+
+    # Background group commit and checkpointing
+    def _run_checkpointer(self):
+        while not self._stop.wait(self.wal.commit_interval):
+            try:
+                with self.lock:
+                    if self.db is None:
+                        return
+                    self.wal.commit()
+                    if self.pending and time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+                        self.checkpoint()
+            except (IOError, OSError) as e:
+                logging.error(f"Background checkpoint failed: {e}")
+
+    # Applies every logged mutation to shelve, records the sequence reached and empties the log
+    def checkpoint(self):
+        if self.read_only:
+            return
+        with self._session() as db:
+            self.wal.commit()
+            if not self.pending:
+                # Nothing to apply; skip rewriting the shelve index
+                self.last_checkpoint = time.monotonic()
+                return
+            with self._file_lock():
+                for key, (op, value) in self.pending.items():
+                    self._apply(db, op, key, value)
+                db[self.SEQ_KEY] = self.seq
+                self.journal.append(self.unjournaled)
+                self.unjournaled.clear()
+                db.sync()
+            self.wal.truncate()
+            self.pending.clear()
+            self.last_checkpoint = time.monotonic()
+
+    # Pushes logged writes and the key index to disk without closing the handle
+    def flush(self):
+        with self.lock:
+            if self.db is not None:
+                self.checkpoint()
+
+    def close(self):
+        self._stop.set()
+        with self.lock:
+            if self.db is not None:
+                if not self.read_only:
+                    self.checkpoint()
+                    self.wal.close()
+                self.journal.close()
+                self.db.close(stale=self.shared)
+                self.db = None
+                for lock_file in (self.lock_file, self.owner_file):
+                    if lock_file is not None:
+                        lock_file.close()
+
+    def book_key(self, isbn):
+        return f"{self.BOOK_PREFIX}{isbn}"
+
+    def user_key(self, username):
+        return f"{self.USER_PREFIX}{username}"
+
+    def get(self, key, default=None):
+        with self._session() as db:
+            if key in self.pending:
+                op, value = self.pending[key]
+                return value if op == 'put' else default
+            return db.get(key, default)
+
+    def put(self, key, value, event='put'):
+        self._log('put', event, key, value)
+
+    def delete(self, key, event='delete'):
+        self._log('delete', event, key)
+
+    # Keys under a prefix as of the latest logged write
+    def _keys(self, db, prefix):
+        self.checkpoint()
+        return db.keys_with_prefix(prefix)
+
+    def load_books(self):
+        with self._session() as db:
+            return {book.get_isbn(): book for book in (db[key] for key in self._keys(db, self.BOOK_PREFIX))}
+
+    def put_book(self, book, event='update'):
+        self.put(self.book_key(book.get_isbn()), book, event)
+
+    def put_books(self, books, event='update'):
+        with self._session():
+            for book in books:
+                self.put_book(book, event)
+
+    def delete_book(self, isbn, event='delete'):
+        self.delete(self.book_key(isbn), event)
+
+    # Bulk load path: writes a batch of books straight into shelve and syncs once, skipping the per-record
+    # write-ahead log. Logged writes are checkpointed first so they cannot overwrite the batch later. A
+    # crash loses at most the batch being written.
+    def put_books_batch(self, books):
+        with self._session() as db:
+            self.checkpoint()
+            with self._file_lock():
+                entries = []
+                for book in books:
+                    key = self.book_key(book.get_isbn())
+                    db[key] = book
+                    self.seq += 1
+                    entries.append((self.seq, 'put', key))
+                db[self.SEQ_KEY] = self.seq
+                self.journal.append(entries)
+                db.sync()
+
+    # Copies every record, as of the latest logged write, into another backend (see migrate_store),
+    # committing it once per batch. Returns the number of records copied.
+    def copy_to(self, target, batch_size=IMPORT_BATCH):
+        with self._session() as db:
+            self.checkpoint()
+            keys = list(db)
+            for start in range(0, len(keys), batch_size):
+                for key in keys[start:start + batch_size]:
+                    target[key] = db[key]
+                target.sync()
+            return len(keys)
+
+    # Sequence number of the latest mutation; an export taken now can later ask for changes since it
+    def change_seq(self):
+        with self._session():
+            return self.seq
+
+    # Journal offset covering every mutation up to change_seq()
+    def journal_position(self):
+        with self._session():
+            self.checkpoint()
+            return self.journal.position()
+
+    # Streams (key, value) for every record under a prefix, unpickling one record at a time and holding
+    # the lock only per record
+    def iter_records(self, prefix):
+        with self._session() as db:
+            keys = self._keys(db, prefix)
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                yield key, value
+
+    # Streams (key, value) for the records under a prefix whose indexed field equals value (see
+    # StorageBackend.INDEXED_FIELDS); the SQLite backend answers this from an index
+    def find_records(self, prefix, field, value):
+        with self._session() as db:
+            self.checkpoint()
+            keys = db.find(prefix, field, value)
+        for key in keys:
+            record = self.get(key)
+            if record is not None:
+                yield key, record
+
+    # (key, value) for one page of the records under a prefix in order of an indexed field, e.g. books by
+    # title; the SQLite backend reads only that page's rows through the index
+    def page_records(self, prefix, field, offset=0, limit=PAGE_SIZE):
+        with self._session() as db:
+            self.checkpoint()
+            keys = db.page(prefix, field, offset, limit)
+        return [(key, record) for key, record in ((key, self.get(key)) for key in keys) if record is not None]
+
+    # {key: op} of the last change to each key under a prefix after seq ('put' or 'delete'), in change order.
+    # offset is an optional journal_position() recorded at or before seq, to skip older journal entries.
+    def changes_since(self, seq, prefix, offset=0):
+        self.flush()
+        changes = {}
+        for entry_seq, op, key in self.journal.since(seq, offset):
+            if key.startswith(prefix):
+                changes.pop(key, None)
+                changes[key] = op
+        return changes
+
+    def load_users(self):
+        with self._session() as db:
+            return [db[key] for key in self._keys(db, self.USER_PREFIX)]
+
+    # Version stamp bumped on every user write, so cached user lists can tell when they are stale
+    def users_version(self):
+        return self.get(self.USERS_VERSION_KEY, 0)
+
+    def _bump_users_version(self):
+        with self._session():
+            version = self.users_version() + 1
+            self.own_users_versions.add(version)
+            self.put(self.USERS_VERSION_KEY, version)
+
+    def put_user(self, user, event='update_user'):
+        with self._session():
+            self.put(self.user_key(user.username), user, event)
+            self._bump_users_version()
+
+    def put_users(self, users, event='update_user'):
+        with self._session():
+            for user in users:
+                self.put_user(user, event)
+
+    def delete_user(self, username, event='delete_user'):
+        with self._session():
+            self.delete(self.user_key(username), event)
+            self._bump_users_version()
+
+    def delete_all_users(self):
+        with self._session() as db:
+            for key in self._keys(db, self.USER_PREFIX):
+                self.delete(key, 'delete_user')
+            self._bump_users_version()
+
+
+################################## end class LibraryStore ############################################
+
+
+################################## class BookCatalog and CatalogRecordFile ############################################
+# isbn -> Book mapping behind booklist. It can start from the ISBNs alone: a book is decoded from the
+# catalog record file (or, when the file has no current record for it, unpickled from the store) the first
+# time it is read and kept from then on.
+class BookCatalog(MutableMapping):
+    def __init__(self, store, books, records=None):
+        self.store = store
+        self.books = books  # isbn -> Book, or None until first read
+        self.records = records  # CatalogRecordFile the unread books come from, if any
+        self.load_lock = threading.Lock()  # every reader of an ISBN must get the same Book object
+
+    def __getitem__(self, isbn):
+        book = self.books[isbn]
+        if book is None:
+            loaded = self.records.get(isbn) if self.records is not None else None
+            if loaded is None:
+                loaded = self.store.get(self.store.book_key(isbn))
+            if loaded is None:
+                raise KeyError(isbn)
+            with self.load_lock:
+                book = self.books.get(isbn)
+                if book is None:
+                    book = self.books[isbn] = loaded
+        return book
+
+    def __setitem__(self, isbn, book):
+        self.books[isbn] = book
+
+    def __delitem__(self, isbn):
+        del self.books[isbn]
+
+    def __contains__(self, isbn):
+        return isbn in self.books
+
+    def __iter__(self):
+        return iter(self.books)
+
+    def __len__(self):
+        return len(self.books)
+
+    # The Book for isbn if it has been read already, else None (without reading it)
+    def loaded(self, isbn):
+        return self.books.get(isbn)
+
+
+# The whole catalog in one memory-mapped file, written at exit and read at startup:
+#   header   magic, change sequence and journal offset the file was written at, number of books
+#   isbns    sorted int64 ISBNs
+#   offsets  int64 file offset of each book's record, plus the end of the last one
+#   records  one per book: copies, points and availability, then the five strings as UTF-8
+#            (a book whose fields do not fit that layout is stored pickled instead)
+# The ISBN and offset tables are used in place through memoryviews over the map, so startup builds the
+# tree from the ISBNs without reading any record, and a book is decoded straight from its bytes in the
+# page cache when it is first read. Only the books actually touched are ever brought into memory.
+class CatalogRecordFile:
+    HEADER = struct.Struct('<8sqqq')
+    MAGIC = b'BOOKREC1'
+    RECORD = struct.Struct('<BqqB5I')
+    STRUCTURED, PICKLED = 0, 1
+
+    def __init__(self, path):
+        self.path = path
+        self.seq = None
+        self.offset = 0
+        self.view = None
+        self.isbns = ()
+        self.offsets = ()
+        self.stale = set()  # ISBNs changed since the file was written; their records are out of date
+
+    # The mapped ISBN table, or None when there is no usable file
+    def load(self):
+        try:
+            with open(self.path, 'rb') as record_file:
+                mapped = mmap.mmap(record_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            magic, seq, offset, count = self.HEADER.unpack_from(mapped, 0)
+        except struct.error:
+            return None
+        isbns_end = self.HEADER.size + 8 * count
+        offsets_end = isbns_end + 8 * (count + 1)
+        if magic != self.MAGIC or count < 0 or offsets_end > len(mapped):
+            return None
+        view = memoryview(mapped)
+        offsets = view[isbns_end:offsets_end].cast('q')
+        if offsets[count] != len(mapped):
+            return None
+        self.view, self.seq, self.offset = view, seq, offset
+        self.isbns = view[self.HEADER.size:isbns_end].cast('q')
+        self.offsets = offsets
+        return self.isbns
+
+    # Marks books whose records were superseded by later changes in the store
+    def invalidate(self, isbns):
+        self.stale.update(isbns)
+
+    def _find(self, isbn):
+        if self.view is None or isbn in self.stale:
+            return None
+        index = bisect.bisect_left(self.isbns, isbn)
+        if index == len(self.isbns) or self.isbns[index] != isbn:
+            return None
+        return self.offsets[index], self.offsets[index + 1]
+
+    # The current record of isbn as a view into the map, or None
+    def raw(self, isbn):
+        span = self._find(isbn)
+        return self.view[span[0]:span[1]] if span else None
+
+    # The Book stored for isbn, decoded from the mapped record, or None if the file has no current record
+    def get(self, isbn):
+        record = self.raw(isbn)
+        if record is None:
+            return None
+        if record[0] == self.PICKLED:
+            return pickle.loads(record[1:])
+        _, copies, points, availability, *lengths = self.RECORD.unpack_from(record)
+        fields = []
+        position = self.RECORD.size
+        for length in lengths:
+            fields.append(str(record[position:position + length], 'utf-8'))
+            position += length
+        title, publisher, language, author, genre = fields
+        return Book(isbn, title, publisher, language, copies, bool(availability), author, genre, points)
+
+    @classmethod
+    def encode(cls, book):
+        strings = (book._title, book._publisher, book._language, book._author, book._genre)
+        if all(type(value) is str for value in strings) and type(book._noOfCopies) is int and \
+                type(book._points_value) is int and type(book._availability) is bool:
+            data = [value.encode('utf-8') for value in strings]
+            try:
+                return cls.RECORD.pack(cls.STRUCTURED, book._noOfCopies, book._points_value, book._availability,
+                                       *map(len, data)) + b''.join(data)
+            except struct.error:
+                pass
+        return bytes([cls.PICKLED]) + pickle.dumps(book, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # Writes count (isbn, record bytes) pairs, in ISBN order, to a new file next to the old one and swaps it
+    # in, so a crash leaves one or the other. The tables are filled in after the records have streamed out.
+    def save(self, count, records, seq, offset):
+        isbns = array('q')
+        offsets = array('q')
+        position = self.HEADER.size + 16 * count + 8
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as record_file:
+            record_file.seek(position)
+            for isbn, record in records:
+                isbns.append(isbn)
+                offsets.append(position)
+                record_file.write(record)
+                position += len(record)
+            offsets.append(position)
+            if len(isbns) != count:
+                raise ValueError("The catalog changed while it was being saved.")
+            record_file.seek(0)
+            record_file.write(self.HEADER.pack(self.MAGIC, seq, offset, count))
+            isbns.tofile(record_file)
+            offsets.tofile(record_file)
+            record_file.flush()
+            os.fsync(record_file.fileno())
+        os.replace(temp_path, self.path)
+        self.seq, self.offset = seq, offset
+
+
+################################## end class BookCatalog and CatalogRecordFile ############################################
+
 # Initialize global variables
 operation_stack = Stack()
 book_tree = BinarySearchTree()
+try:
+    store = LibraryStore()
+except (IOError, OSError, sqlite3.Error) as e:
+    print(f"\n** Could not open the book management database: {e} **")
+    logging.error(f"Could not open the book management database: {e}")
+    sys.exit(1)
 
 
 # Sample user data for users to access in
 def initialize_users():
-    with shelve.open('book_management_db') as db:
-        if 'users' not in db:
-            db['users'] = [
-                User("admin", "admin123", "admin"),
-                User("librarian", "librarian123", "librarian"),
-                User("customer", "customer123", "customer", "customer001", "customer@email.com")
-            ]
-        return list(db['users'])
+    if not store.get('users_seeded') and not store.read_only:
+        store.put_users([
+            User("admin", "admin123", "admin"),
+            User("librarian", "librarian123", "librarian"),
+            User("customer", "customer123", "customer", "customer001", "customer@email.com")
+        ], 'add_user')
+        store.put('users_seeded', True)
+    return UserDirectory(store.load_users())
+
+
+################################## class UserCache ############################################
+# Holds the UserDirectory loaded once per process. It is only reloaded when the store's users version
+# stamp has moved because of a write this process did not make itself, i.e. when any stamp since the
+# cached one was written by another process.
+class UserCache:
+    def __init__(self, store, loader):
+        self.store = store
+        self.loader = loader
+        self.directory = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            version = self.store.users_version()
+            own = self.store.own_users_versions
+            if self.directory is None or version < self.version or \
+                    any(stamp not in own for stamp in range(self.version + 1, version + 1)):
+                self.directory = self.loader()
+                version = self.store.users_version()
+            own.difference_update([stamp for stamp in own if stamp <= version])
+            self.version = version
+            return self.directory
+
+
+################################## end class UserCache ############################################
+
+
+user_cache = UserCache(store, initialize_users)
+users = user_cache.get()
 
 
 
 ################################# CAFE SECTION ###########################################
 
 # Initialize shelve for storing user and book data
-with shelve.open('book_management_db') as db:
-    if 'books' not in db:  # Use 'books' for consistency
-        db['books'] = {}
-    if 'menu_items' not in db:
-        db['menu_items'] = [
-            MenuItem("Coffee", 10),
-            MenuItem("Tea", 8),
-            MenuItem("Sandwich", 15),
-            MenuItem("Cake", 12)
-        ]
+menu_items = store.get('menu_items')
+if menu_items is None:
+    menu_items = [
+        MenuItem("Coffee", 10),
+        MenuItem("Tea", 8),
+        MenuItem("Sandwich", 15),
+        MenuItem("Cake", 12)
+    ]
+    if not store.read_only:
+        store.put('menu_items', menu_items)
+
+# Load book data: the catalog record file plus the journaled changes since it, falling back to reading
+# every book from the store when there is no record file yet. Books changed since the file was written
+# are read from the store, the rest are decoded from the file on first use, and the tree is built lazily.
+def load_catalog():
+    isbns = catalog_records.load()
+    if isbns is None:
+        catalog = BookCatalog(store, store.load_books())
+        return catalog, sorted(catalog)
+    changes = store.changes_since(catalog_records.seq, store.BOOK_PREFIX, catalog_records.offset)
+    if changes:
+        current = set(isbns)
+        changed = [int(key[len(store.BOOK_PREFIX):]) for key in changes]
+        for isbn, op in zip(changed, changes.values()):
+            if op == 'put':
+                current.add(isbn)
+            else:
+                current.discard(isbn)
+        catalog_records.invalidate(changed)
+        isbns = sorted(current)
+    return BookCatalog(store, dict.fromkeys(isbns), catalog_records), isbns
+
+
+# (isbn, record) for every book in ISBN order. Books never read in this run are copied over from the
+# current file as they are; the rest are encoded from the in-memory (or stored) Book.
+def catalog_record_entries():
+    for isbn in sorted(booklist):
+        book = booklist.loaded(isbn)
+        if book is None:
+            record = catalog_records.raw(isbn)
+            if record is not None:
+                yield isbn, record
+                continue
+            book = booklist[isbn]
+        yield isbn, CatalogRecordFile.encode(book)
+
+
+# Rewrites the catalog record file if the catalog changed since it was written; a read-only or already
+# closed store leaves it alone
+def save_catalog_records():
+    if store.db is None or store.read_only:
+        return
+    try:
+        with store.transaction():
+            if catalog_records.seq is not None and \
+                    not store.changes_since(catalog_records.seq, store.BOOK_PREFIX, catalog_records.offset):
+                return
+            catalog_records.save(len(booklist), catalog_record_entries(), store.change_seq(),
+                                 store.journal_position())
+    except (IOError, OSError, OverflowError, TypeError, ValueError, KeyError) as e:
+        logging.error(f"Could not save the catalog record file: {e}")
+
+
+catalog_records = CatalogRecordFile(f"{store.path}.books")
+booklist, catalog_isbns = load_catalog()
+book_tree.build_lazy(catalog_isbns, booklist.__getitem__)
+del catalog_isbns
+atexit.register(save_catalog_records)
+
+# Sorted secondary indexes behind the sort views, each built on first use
+book_indexes = CatalogIndexes(booklist)
+book_indexes.register('publisher', SortedIndex(lambda book: book.get_publisher()))
+book_indexes.register('copies', SortedIndex(lambda book: -book.get_noOfCopies()))
+book_indexes.register('title', SortedIndex(lambda book: book.get_title().lower()))
+book_indexes.register('language_isbn', SortedIndex(lambda book: book.get_language()))
+
+# Full-text search over title, author, publisher and genre
+book_indexes.register('text', InvertedIndex())
+
+# Typo-tolerant title matching for searches that find nothing
+book_indexes.register('title_trigrams', TrigramIndex())
+
+# Columnar snapshot for the catalog reports, when NumPy is installed
+if np is not None:
+    book_indexes.register('columns', CatalogColumns())
+
+
+########################### SERVICE LAYER ###################################
+
+class ServiceError(Exception):
+    pass
+
+
+# Yes/no value from a feed or client: a bool, or text such as "Yes", "y", "true" or "1"
+def parse_flag(value):
+    return value if isinstance(value, bool) else str(value).strip().lower() in ('yes', 'y', 'true', '1')
+
+
+# Fixed set of locks handed out by key hash, so operations on different books (or users) rarely wait for
+# each other and the number of locks does not grow with the catalog
+class LockStripes:
+    def __init__(self, count=LOCK_STRIPES):
+        self.locks = [threading.Lock() for _ in range(count)]
+
+    def lock(self, key):
+        return self.locks[hash(key) % len(self.locks)]
 
-    # Load book and menu data
-    booklist = db['books']
-    menu_items = db['menu_items']
 
-# Rebuild the BST from the booklist
-for isbn, book in booklist.items():
-    book_tree.insert(book)
+# The library's operations without any terminal I/O, shared by the menus and the network front end. Each
+# method checks permissions and input, keeps the tree, catalog, indexes and store in step, and raises
+# ServiceError with a user-facing message when the operation cannot be done.
+#
+# Methods are safe to call from many threads. A book's read-check-write (e.g. a borrow) runs under that
+# ISBN's lock and a user's points change under that user's lock, so unrelated borrows and cafe orders run
+# in parallel. The tree, catalog and index structures are shared by every book, so changes to them and
+# reads of them take catalog_lock, but only for the in-memory step. Lock order is book, then user, then
+# catalog, then the store's own lock, which rules out deadlocks.
+#
+# Each method is also one store transaction. With a shared store (LIBRARY_SHARED_STORE=1) that holds the
+# store lock for the whole operation and brings this process up to date with the other processes' writes
+# before anything is read, so there the store lock is taken first, before any of the others; the refresh
+# listener (refresh_from_store) likewise takes catalog_lock inside it. Otherwise it does nothing.
+class LibraryService:
+    BOOK_FIELDS = {'title': ('_title', str), 'publisher': ('_publisher', str), 'language': ('_language', str),
+                   'copies': ('_noOfCopies', int), 'availability': ('_availability', parse_flag),
+                   'author': ('_author', str), 'genre': ('_genre', str), 'points': ('_points_value', int)}
+    SORT_ORDERS = ('publisher', 'copies', 'title', 'language_isbn')
+
+    def __init__(self):
+        self.catalog_lock = threading.RLock()
+        self.book_locks = LockStripes()
+        self.user_locks = LockStripes()
+
+    @staticmethod
+    def _require_staff(user):
+        if not (is_admin(user) or user.role == "librarian"):
+            raise ServiceError("Unauthorized access.")
+
+    @staticmethod
+    def _save(write):
+        try:
+            write()
+        except IOError as ioe:
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            raise ServiceError(f"An I/O error occurred while accessing the database: {ioe}")
+
+    # Takes the user's points from the store, where another process may have changed them (shared mode)
+    @staticmethod
+    def _refresh_user(user):
+        if not store.shared:
+            return
+        stored = store.get(store.user_key(user.username))
+        if stored is not None:
+            user.points = stored.points
+            user.tier = user.determine_tier()
+
+    def login(self, username, password):
+        with store.transaction():
+            user = user_cache.get().get(username)
+            if user is None or user.password != password:
+                raise ServiceError("Invalid username or password.")
+            return user
+
+    def get_book(self, isbn):
+        with store.transaction():
+            with self.catalog_lock:
+                node = book_tree.search(isbn)
+                if node is None:
+                    raise ServiceError("Book not found.")
+                return node.book
+
+    # Up to limit books in ISBN order, starting after the ISBN of the last book of the previous page
+    def list_books(self, after=None, limit=PAGE_SIZE):
+        with store.transaction():
+            with self.catalog_lock:
+                books = book_tree.iter_from(after)
+                if after is not None:
+                    books = (book for book in books if book.get_isbn() != after)
+                return list(itertools.islice(books, limit))
+
+    def sorted_books(self, order, offset=0, limit=PAGE_SIZE):
+        if order not in self.SORT_ORDERS:
+            raise ServiceError(f"Unknown sort order '{order}'.")
+        with store.transaction():
+            with self.catalog_lock:
+                return list(itertools.islice(book_indexes.ordered_books(order), offset, offset + limit))
+
+    def search_books(self, query, limit=PAGE_SIZE):
+        with store.transaction():
+            with self.catalog_lock:
+                return [booklist[isbn] for isbn in book_indexes.get('text').search(query, limit)]
+
+    def add_book(self, user, book):
+        self._require_staff(user)
+        with store.transaction():
+            isbn = book.get_isbn()
+            with self.book_locks.lock(isbn):
+                with self.catalog_lock:
+                    if book_tree.search(isbn):
+                        raise ServiceError("ISBN must be unique.")
+                    book_tree.insert(book)
+                    booklist[isbn] = book
+                    book_indexes.add(book)
+                self._save(lambda: store.put_book(book, 'add'))
+            logging.info(f"{user.username} added book with ISBN: {isbn}.")
+            return book
+
+    # Applies {field: value} changes (see BOOK_FIELDS) and returns a copy of the book as it was before
+    def update_book(self, user, isbn, changes):
+        self._require_staff(user)
+        try:
+            values = {self.BOOK_FIELDS[field][0]: self.BOOK_FIELDS[field][1](value) for field, value in changes.items()}
+        except KeyError as e:
+            raise ServiceError(f"Unknown book field {e}.")
+        except (TypeError, ValueError):
+            raise ServiceError("Invalid value for a book field.")
+        with store.transaction():
+            with self.book_locks.lock(isbn):
+                book = self.get_book(isbn)
+                previous = Book(book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
+                                book.get_noOfCopies(), book.get_availability() == "Yes", book.get_author(),
+                                book.get_genre(), book.get_points_value())
+                with self.catalog_lock:
+                    for attribute, value in values.items():
+                        setattr(book, attribute, value)
+                    book_indexes.update(book)
+                self._save(lambda: store.put_book(book))
+            logging.info(f"{user.username} updated book with ISBN: {isbn}.")
+            return previous
+
+    def delete_book(self, user, isbn):
+        self._require_staff(user)
+        with store.transaction():
+            with self.book_locks.lock(isbn):
+                with self.catalog_lock:
+                    book = self.get_book(isbn)
+                    book_tree.delete(isbn)
+                    del booklist[isbn]
+                    book_indexes.discard(isbn)
+                self._save(lambda: store.delete_book(isbn))
+            logging.info(f"{user.username} deleted book with ISBN: {isbn}.")
+            return book
+
+    def borrow_book(self, user, isbn, copies):
+        if user.role != "customer":
+            raise ServiceError("Only customers can borrow books.")
+        with store.transaction():
+            with self.book_locks.lock(isbn), self.user_locks.lock(user.username):
+                book = self.get_book(isbn)
+                self._refresh_user(user)
+                if book.get_availability() == "No" or book.get_noOfCopies() == 0:
+                    raise ServiceError("This book is not available for borrowing.")
+                if copies <= 0 or copies > book.get_noOfCopies():
+                    raise ServiceError("Invalid number of copies.")
+                with self.catalog_lock:
+                    book._noOfCopies -= copies
+                    if book.get_noOfCopies() == 0:
+                        book._availability = False
+                    book_indexes.update(book)
+                user.update_points(book.get_points_value() * copies)
+
+                def write():
+                    store.put_book(book, 'borrow')
+                    store.put_user(user, 'points')
+                self._save(write)
+            return book
+
+    def cafe_menu(self):
+        with store.transaction():
+            return list(menu_items)
+
+    def order_from_cafe(self, user, item_name):
+        with store.transaction():
+            item = next((item for item in menu_items if item.name == item_name.strip().title()), None)
+            if item is None:
+                raise ServiceError("Item not found in the menu.")
+            with self.user_locks.lock(user.username):
+                self._refresh_user(user)
+                if not user.spend_points(item.points):
+                    raise ServiceError("You do not have enough points to order this item.")
+                self._save(lambda: store.put_user(user, 'points'))
+            return item
+
+
+library_service = LibraryService()
 
 
 def display_cafe_menu():
@@ -296,26 +2223,10 @@ def order_from_cafe(user):
         item_name = input("Enter the name of the item you want to order or type 'B' to go back: ").strip().title()
         if item_name.upper() == 'B':
             return
-        item = next((item for item in menu_items if item.name == item_name), None)
-        if not item:
-            print("\n** Item not found in the menu. **")
-            return
-        if user.spend_points(item.points):
-            print(f"\n-- You have successfully ordered {item_name}. --")
-            try:
-                with shelve.open('book_management_db') as db:
-                    users = db['users']
-                    for db_user in users:
-                        if db_user.username == user.username:
-                            db_user.points = user.points
-                            db_user.tier = user.tier
-                            break
-                    db['users'] = users
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-        else:
-            print("\n** You do not have enough points to order this item. **")
+        library_service.order_from_cafe(user, item_name)
+        print(f"\n-- You have successfully ordered {item_name}. --")
+    except ServiceError as e:
+        print(f"\n** {e} **")
     except Exception as e:
         print(f"An error occurred: {e}")
 
@@ -335,7 +2246,7 @@ def create_account():
             username = input("\nEnter a new username or type 'B' to go back: ")
             if username.upper() == 'B':
                 return
-            if any(user.username == username for user in users):
+            if username in users:
                 raise ValueError("\n** Username already exists. **")
 
             while True:
@@ -388,16 +2299,19 @@ def create_account():
                         continue
                     break
 
-                existing_customer_ids = [user.customer_id for user in users if user.customer_id]
-                customer_id = generate_unique_customer_id(existing_customer_ids)
-                user = User(username, password, role, customer_id=customer_id, email=email)
-            else:
-                user = User(username, password, role)
-
-            users.append(user)
             try:
-                with shelve.open('book_management_db') as db:
-                    db['users'] = users
+                # Checked again against the store: another terminal may have taken the name meanwhile
+                with store.transaction():
+                    if store.get(store.user_key(username)) is not None:
+                        raise ValueError("\n** Username already exists. **")
+                    directory = user_cache.get()
+                    if role == "customer":
+                        customer_id = generate_unique_customer_id(directory.customer_ids())
+                        user = User(username, password, role, customer_id=customer_id, email=email)
+                    else:
+                        user = User(username, password, role)
+                    store.put_user(user, 'add_user')
+                    directory.add(user)
                 print("Account created successfully.")
                 return user
             except IOError as ioe:
@@ -409,9 +2323,9 @@ def create_account():
 
 
 def authenticate(username, password):
-    for user in users:
-        if user.username == username and user.password == password:
-            return user
+    user = users.get(username)
+    if user and user.password == password:
+        return user
     return None
 
 
@@ -419,26 +2333,42 @@ def is_admin(user):
     return user.role == "admin"
 
 
+# Table row for one book, in the column order of the book listings
+def book_row(book):
+    return [
+        book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
+        book.get_noOfCopies(), book.get_availability(), book.get_author(), book.get_genre(),
+        book.get_points_value()
+    ]
+
+
+# Prints rows a page at a time. Rows are pulled lazily from the iterator (the cursor) and each page is
+# tabulated on its own, so the first page appears straight away and memory is bounded by the page size.
+def print_paginated(rows, headers, page_size=PAGE_SIZE):
+    rows = iter(rows)
+    page = list(itertools.islice(rows, page_size))
+    if not page:
+        print(tabulate([], headers, tablefmt="grid"))
+        return
+    page_number = 1
+    while page:
+        next_row = next(rows, None)
+        print(tabulate(page, headers, tablefmt="grid"))
+        if next_row is None:
+            return
+        choice = input(f"-- Page {page_number}. Press Enter for the next page or type 'B' to stop: ")
+        if choice.upper() == 'B':
+            return
+        page = [next_row] + list(itertools.islice(rows, page_size - 1))
+        page_number += 1
+
+
 def display_all_books(user):
     print("\n-- These are all the book records --\n")
     if is_admin(user) or user.role in ["librarian", "customer"]:
         headers = ["ISBN", "Title", "Publisher", "Language", "Number of Copies", "Availability", "Author", "Genre",
                    "Points"]
-        table = []
-
-        def print_inorder(node):
-            if node:
-                print_inorder(node.left)
-                book = node.book
-                table.append([
-                    book.get_isbn(), book.get_title(), book.get_publisher(),
-                    book.get_language(), book.get_noOfCopies(), book.get_availability(),
-                    book.get_author(), book.get_genre(), book.get_points_value()
-                ])
-                print_inorder(node.right)
-
-        print_inorder(book_tree.root)
-        print(tabulate(table, headers, tablefmt="grid"))
+        print_paginated((book_row(book) for book in book_tree.iter_inorder()), headers)
         logging.info(f"{user.username} viewed all books.")
     else:
         print("** Unauthorized access. **")
@@ -462,15 +2392,11 @@ def add_new_book(user, isbn, title, publisher, language, noOfCopies, availabilit
                 print("\n** Invalid input for points. Please enter a valid number. **")
 
         book = Book(isbn, title, publisher, language, noOfCopies, availability, author, genre, points_value)
-        book_tree.insert(book)
-        booklist[isbn] = book
-
         try:
-            with shelve.open('book_management_db') as db:
-                db['books'] = booklist
-        except IOError as ioe:
-            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            library_service.add_book(user, book)
+        except ServiceError as e:
+            print(f"\n** {e} **")
+            return
 
         # Push the operation to the stack
         operation_stack.push(('add', isbn, book))
@@ -494,10 +2420,7 @@ def update_book(user, isbn):
                 return
 
             book = node.book
-            # Record the previous state of the book
-            previous_book_state = Book(book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
-                                       book.get_noOfCopies(), book.get_availability() == "Yes", book.get_author(),
-                                       book.get_genre(), book.get_points_value())
+            changes = {}
             print("\n-- Current Book Details --")
             print_book_info(book)
 
@@ -505,64 +2428,62 @@ def update_book(user, isbn):
             if new_title.upper() == 'B':
                 return
             elif new_title:
-                book._title = new_title
+                changes['title'] = new_title
 
             new_publisher = input("Enter new publisher or press enter to keep current [or type 'B' to go back]: ")
             if new_publisher.upper() == 'B':
                 return
             elif new_publisher:
-                book._publisher = new_publisher
+                changes['publisher'] = new_publisher
 
             new_language = input("Enter new language or press enter to keep current [or type 'B' to go back]: ")
             if new_language.upper() == 'B':
                 return
             elif new_language:
-                book._language = new_language
+                changes['language'] = new_language
 
             new_noOfCopies = input(
                 "Enter new number of copies or press enter to keep current [or type 'B' to go back]: ")
             if new_noOfCopies.upper() == 'B':
                 return
             elif new_noOfCopies:
-                book._noOfCopies = int(new_noOfCopies)
+                changes['copies'] = int(new_noOfCopies)
 
             new_availability = input(
                 "Enter new availability (Y/N) or press enter to keep current [or type 'B' to go back]: ").upper()
             if new_availability == 'B':
                 return
             elif new_availability in ['Y', 'N']:
-                book._availability = True if new_availability == 'Y' else False
+                changes['availability'] = new_availability == 'Y'
 
             new_author = input("Enter new author or press enter to keep current [or type 'B' to go back]: ")
             if new_author.upper() == 'B':
                 return
             elif new_author:
-                book._author = new_author
+                changes['author'] = new_author
 
             new_genre = input("Enter new genre or press enter to keep current [or type 'B' to go back]: ")
             if new_genre.upper() == 'B':
                 return
             elif new_genre:
-                book._genre = new_genre
+                changes['genre'] = new_genre
 
             new_points_value = input("Enter new points value or press enter to keep current [or type 'B' to go back]: ")
             if new_points_value.upper() == 'B':
                 return
             elif new_points_value:
-                book._points_value = int(new_points_value)
+                changes['points'] = int(new_points_value)
 
             try:
-                with shelve.open('book_management_db') as db:
-                    db['books'] = booklist
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+                previous_book_state = library_service.update_book(user, isbn, changes)
+            except ServiceError as e:
+                print(f"\n** {e} **")
+                return
 
             # Push the previous state onto the stack
             operation_stack.push(('update', isbn, previous_book_state))
 
             print("Book updated successfully.")
-            logging.info(f"{user.username} updated book with ISBN: {isbn}.")
         else:
             raise PermissionError("** Unauthorized access. **")
     except PermissionError as e:
@@ -578,27 +2499,15 @@ def delete_book(user, isbn):
         if not (is_admin(user) or user.role == "librarian"):
             raise PermissionError("** Unauthorized access. **")
 
-        node = book_tree.search(isbn)
-        if not node:
-            raise ValueError("\n** Book not found. **")
-
-        book = node.book
-        book_tree.delete(isbn)
-        del booklist[isbn]
-
-        try:
-            with shelve.open('book_management_db') as db:
-                db['books'] = booklist
-        except IOError as ioe:
-            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+        book = library_service.delete_book(user, isbn)
 
         # Push the operation to the stack
         operation_stack.push(('delete', isbn, book))
 
         print('Book deleted successfully')
-        logging.info(f"{user.username} deleted book with ISBN: {isbn}.")
-    except (ValueError, PermissionError) as e:
+    except ServiceError as e:
+        print(f"\n** {e} **")
+    except PermissionError as e:
         print(e)
 
 
@@ -613,20 +2522,20 @@ def delete_user(admin_user):
         if username_to_delete == 'B':
             return
 
-        user_to_delete = next((user for user in users if user.username == username_to_delete), None)
+        # Looked up in the store, which has any change another terminal made since the list was loaded
+        try:
+            with store.transaction():
+                user_to_delete = store.get(store.user_key(username_to_delete))
+                if user_to_delete:
+                    directory = user_cache.get()
+                    directory.remove(directory.get(username_to_delete) or user_to_delete)
+                    store.delete_user(user_to_delete.username)
+        except IOError as ioe:
+            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            return  # Exit the function if there's an I/O error
 
         if user_to_delete:
-            users.remove(user_to_delete)
-
-            # Save the updated user list to the shelve database
-            try:
-                with shelve.open('book_management_db') as db:
-                    db['users'] = users
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-                return  # Exit the function if there's an I/O error
-
             # Push the operation to the stack
             operation_stack.push(('delete_user', user_to_delete.username, user_to_delete))
 
@@ -649,13 +2558,11 @@ def delete_all_users(admin_user):
         confirmation = input(
             "Are you sure you want to delete ALL user accounts? This action cannot be undone. Type 'yes' to confirm: ")
         if confirmation.lower() == 'yes':
-            global users
-            previous_users = users.copy()  # Make a copy of the current users list
-            users = []
+            previous_users = list(users)  # Make a copy of the current users list
+            users.reset([])
 
             try:
-                with shelve.open('book_management_db', writeback=True) as db:
-                    db['users'] = users
+                store.delete_all_users()
             except IOError as ioe:
                 print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
                 logging.error(f"An I/O error occurred while accessing the database: {ioe}")
@@ -675,7 +2582,6 @@ def delete_all_users(admin_user):
 
 
 def undo_last_operation(user):
-    global users  # Add this line to modify the global users variable
     if not (is_admin(user) or user.role == "librarian"):
         print("** Unauthorized access. **")
         return
@@ -687,112 +2593,110 @@ def undo_last_operation(user):
     operation, identifier, item = operation_stack.pop()
 
     try:
-        if operation == 'add':
-            book_tree.delete(identifier)
-            del booklist[identifier]
-            try:
-                with shelve.open('book_management_db') as db:
-                    db['books'] = booklist
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-                return  # Exit the function if there's an I/O error
-            print("Undo successful: Last book addition has been undone.")
-        elif operation == 'delete':
-            book_tree.insert(item)
-            booklist[identifier] = item
-            try:
-                with shelve.open('book_management_db') as db:
-                    db['books'] = booklist
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-                return  # Exit the function if there's an I/O error
-            print("Undo successful: Last book deletion has been undone.")
-        elif operation == 'delete_user':
-            users.append(item)
-            try:
-                with shelve.open('book_management_db') as db:
-                    db['users'] = users
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-                return  # Exit the function if there's an I/O error
-            print("Undo successful: Last user deletion has been undone.")
-        elif operation == 'delete_all_users':
-            users = item  # Restore the previous state of users
-            try:
-                with shelve.open('book_management_db', writeback=True) as db:
-                    db['users'] = users
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-                return  # Exit the function if there's an I/O error
-            print("Undo successful: Deletion of all users has been undone.")
-        elif operation == 'update':
-            # Restore the previous state of the book
-            book_tree.delete(identifier)
-            book_tree.insert(item)
-            booklist[identifier] = item
-            try:
-                with shelve.open('book_management_db') as db:
-                    db['books'] = booklist
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-                return  # Exit the function if there's an I/O error
-            print("Undo successful: Last book update has been undone.")
-        elif operation == 'reset_password':
-            for user in users:
-                if user.username == identifier:
-                    user.password = item  # Restore the old password
-                    break
-            try:
-                with shelve.open('book_management_db') as db:
-                    db['users'] = users
-            except IOError as ioe:
-                print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-                return  # Exit the function if there's an I/O error
-            print("Undo successful: Last password reset has been undone.")
+        # One transaction, so the checks below see the other terminals' latest writes (shared mode)
+        with store.transaction(), library_service.catalog_lock:
+            undo_operation(operation, identifier, item)
     except Exception as e:
         print(f"An error occurred during undo: {e}")
         logging.error(f"An error occurred during undo: {e}")
 
 
+def undo_operation(operation, identifier, item):
+    if operation == 'add':
+        if book_tree.search(identifier) is None:
+            print("\n** That book has already been deleted. **")
+            return
+        book_tree.delete(identifier)
+        del booklist[identifier]
+        book_indexes.discard(identifier)
+        try:
+            store.delete_book(identifier, 'undo')
+        except IOError as ioe:
+            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            return  # Exit the function if there's an I/O error
+        print("Undo successful: Last book addition has been undone.")
+    elif operation == 'delete':
+        # The ISBN may have been added again since the deletion
+        if book_tree.search(identifier) is not None:
+            print(f"\n** A book with ISBN {identifier} already exists; the deletion cannot be undone. **")
+            return
+        book_tree.insert(item)
+        booklist[identifier] = item
+        book_indexes.update(item)
+        try:
+            store.put_book(item, 'undo')
+        except IOError as ioe:
+            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            return  # Exit the function if there's an I/O error
+        print("Undo successful: Last book deletion has been undone.")
+    elif operation == 'delete_user':
+        if store.get(store.user_key(identifier)) is not None:
+            print(f"\n** The username '{identifier}' has been taken again; the deletion cannot be undone. **")
+            return
+        try:
+            store.put_user(item, 'undo')
+        except IOError as ioe:
+            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            return  # Exit the function if there's an I/O error
+        user_cache.get().add(item)
+        print("Undo successful: Last user deletion has been undone.")
+    elif operation == 'delete_all_users':
+        # Accounts created since the deletion are kept; only the deleted ones still free are restored
+        restored = [user for user in item if store.get(store.user_key(user.username)) is None]
+        try:
+            store.put_users(restored, 'undo')
+        except IOError as ioe:
+            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            return  # Exit the function if there's an I/O error
+        directory = user_cache.get()
+        for user in restored:
+            directory.add(user)
+        print("Undo successful: Deletion of all users has been undone.")
+    elif operation == 'update':
+        if book_tree.search(identifier) is None:
+            print("\n** That book has since been deleted; the update cannot be undone. **")
+            return
+        # Restore the previous state of the book
+        book_tree.delete(identifier)
+        book_tree.insert(item)
+        booklist[identifier] = item
+        book_indexes.update(item)
+        try:
+            store.put_book(item, 'undo')
+        except IOError as ioe:
+            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            return  # Exit the function if there's an I/O error
+        print("Undo successful: Last book update has been undone.")
+    elif operation == 'reset_password':
+        restored_user = store.get(store.user_key(identifier))
+        try:
+            if restored_user:
+                restored_user.password = item  # Restore the old password
+                store.put_user(restored_user, 'undo')
+                cached = user_cache.get().get(identifier)
+                if cached is not None:
+                    cached.password = item
+        except IOError as ioe:
+            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            return  # Exit the function if there's an I/O error
+        print("Undo successful: Last password reset has been undone.")
+
 
-
-def sort_book_publisher(user):
-    def get_publisher(book):
-        return book.get_publisher()
-
-    try:
-        print("\n---------------------------------------------------------------")
-        if is_admin(user) or user.role in ["librarian", "customer"]:
-            books = []
-
-            def collect_books_inorder(node):
-                if node:
-                    collect_books_inorder(node.left)
-                    books.append(node.book)
-                    collect_books_inorder(node.right)
-
-            collect_books_inorder(book_tree.root)
-
-            books.sort(key=get_publisher)
-
-            headers = ["ISBN", "Title", "Publisher", "Language", "Number of Copies", "Availability", "Author", "Genre",
-                       "Points"]
-            table = []
-
-            for book in books:
-                table.append([
-                    book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
-                    book.get_noOfCopies(), book.get_availability(), book.get_author(), book.get_genre(),
-                    book.get_points_value()
-                ])
-
-            print(tabulate(table, headers, tablefmt="grid"))
+def sort_book_publisher(user):
+    try:
+        print("\n---------------------------------------------------------------")
+        if is_admin(user) or user.role in ["librarian", "customer"]:
+            books = book_indexes.ordered_books('publisher')
+
+            headers = ["ISBN", "Title", "Publisher", "Language", "Number of Copies", "Availability", "Author", "Genre",
+                       "Points"]
+            print_paginated((book_row(book) for book in books), headers)
             logging.info(f"{user.username} sorted books by publisher in ascending order.")
         else:
             raise PermissionError("** Unauthorized access. **")
@@ -801,66 +2705,37 @@ def sort_book_publisher(user):
 
 
 def search_book_by_title(user, title):
-    books = []
-
-    def collect_books_inorder(node):
-        if node:
-            collect_books_inorder(node.left)
-            books.append(node.book)
-            collect_books_inorder(node.right)
-
-    collect_books_inorder(book_tree.root)
-
-    search_results = []
     headers = ["ISBN", "Title", "Publisher", "Language", "Number of Copies", "Availability", "Author", "Genre",
                "Points"]
 
-    for book in books:
-        if book.get_title().lower() == title.lower():
-            search_results.append([
-                book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
-                book.get_noOfCopies(), book.get_availability(), book.get_author(), book.get_genre(),
-                book.get_points_value()
-            ])
-
-    if search_results:
+    # Ranked full-text matches; books whose whole title matches the query come first
+    title = title.lower()
+    matches = [booklist[isbn] for isbn in book_indexes.get('text').search(title)]
+    matches.sort(key=lambda book: book.get_title().lower() != title)
+    if matches:
         print("\n-- Search Results --\n")
-        print(tabulate(search_results, headers, tablefmt="grid"))
+        print_paginated((book_row(book) for book in matches), headers)
+        return
+
+    # Nothing matched as typed, so fall back to titles within a few typos of the query
+    suggestions = [book_row(booklist[isbn]) for isbn, distance in book_indexes.get('title_trigrams').search(title)]
+
+    if suggestions:
+        print("\n-- No exact match found. Did you mean: --\n")
+        print(tabulate(suggestions, headers, tablefmt="grid"))
     else:
         print("\n** Book not found. **")
 
 
 def sort_noOfCopies(user):
-    def get_noOfCopies(book):
-        return book.get_noOfCopies()
-
     try:
         print("\n---------------------------------------------------------------")
         if is_admin(user) or user.role in ["librarian", "customer"]:
-            books = []
-
-            def collect_books_inorder(node):
-                if node:
-                    collect_books_inorder(node.left)
-                    books.append(node.book)
-                    collect_books_inorder(node.right)
-
-            collect_books_inorder(book_tree.root)
-
-            books.sort(key=get_noOfCopies, reverse=True)
+            books = book_indexes.ordered_books('copies')
 
             headers = ["ISBN", "Title", "Publisher", "Language", "Number of Copies", "Availability", "Author", "Genre",
                        "Points"]
-            table = []
-
-            for book in books:
-                table.append([
-                    book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
-                    book.get_noOfCopies(), book.get_availability(), book.get_author(), book.get_genre(),
-                    book.get_points_value()
-                ])
-
-            print(tabulate(table, headers, tablefmt="grid"))
+            print_paginated((book_row(book) for book in books), headers)
             logging.info(f"{user.username} sorted books by number of copies in descending order.")
         else:
             raise PermissionError("** Unauthorized access. **")
@@ -868,6 +2743,33 @@ def sort_noOfCopies(user):
         print(e)
 
 
+def display_catalog_report(user):
+    if not (is_admin(user) or user.role == "librarian"):
+        print("** Unauthorized access. **")
+        return
+    if np is None:
+        print("\n** Catalog reports need NumPy. Install it with 'pip install numpy'. **")
+        return
+    catalog_columns = book_indexes.get('columns')
+
+    print("\n-- Catalog Report --\n")
+    print(f"Titles: {len(catalog_columns)}")
+    print(f"Total copies: {int(catalog_columns.column('copies').sum())}")
+    print(f"Titles with zero copies: {len(catalog_columns.zero_copies())}")
+    print(f"Titles marked unavailable: {int((~catalog_columns.column('available')).sum())}")
+
+    by_publisher = sorted(catalog_columns.total_by('publisher').items(), key=lambda item: (-item[1], item[0]))
+    print("\n-- Total copies by publisher --\n")
+    print_paginated(([publisher, copies] for publisher, copies in by_publisher), ["Publisher", "Copies"])
+
+    if len(catalog_columns):
+        counts, edges = catalog_columns.distribution('points')
+        print("\n-- Points value distribution --\n")
+        rows = [[f"{edges[i]:.0f} - {edges[i + 1]:.0f}", int(counts[i])] for i in range(len(counts)) if counts[i]]
+        print(tabulate(rows, ["Points", "Titles"], tablefmt="grid"))
+    logging.info(f"{user.username} viewed the catalog report.")
+
+
 def print_book_info(book):
     print(
         f' ISBN: {book.get_isbn()}\n Title: {book.get_title()}\n Publisher: {book.get_publisher()}\n Language: {book.get_language()}\n Number of Copies: {book.get_noOfCopies()}\n Availability: {book.get_availability()} Author: {book.get_author()}\n Genre: {book.get_genre()}\n Points: {book.get_points_value()}\n\n')
@@ -888,26 +2790,10 @@ def borrow_book(user, isbn):
             return
 
         num_copies_to_borrow = int(input("Enter the number of copies you want to borrow: "))
-        if num_copies_to_borrow <= 0 or num_copies_to_borrow > book.get_noOfCopies():
-            print("\n** Invalid number of copies. **")
-            return
-
-        book._noOfCopies -= num_copies_to_borrow
-        if book.get_noOfCopies() == 0:
-            book._availability = False
-
-        user.update_points(book.get_points_value() * num_copies_to_borrow)
-
-        try:
-            with shelve.open('book_management_db') as db:
-                db['books'] = booklist
-                db['users'] = users
-        except IOError as ioe:
-            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-            return  # Exit the function if there's an I/O error
-
+        library_service.borrow_book(user, isbn, num_copies_to_borrow)
         print("-- Books borrowed successfully. --")
+    except ServiceError as e:
+        print(f"\n** {e} **")
     except (PermissionError, ValueError) as e:
         print(e)
     except Exception as e:
@@ -917,113 +2803,149 @@ def borrow_book(user, isbn):
 
 def view_all_users():
     headers = ["Username", "Role", "CustomerID", "Email", "Tier", "Points"]
-    table = []
-    for user in users:
-        table.append(
-            [user.username, user.role, user.customer_id or "N/A", user.email or "N/A", user.tier or "N/A", user.points])
-    print(tabulate(table, headers, tablefmt="grid"))
+    rows = ([user.username, user.role, user.customer_id or "N/A", user.email or "N/A", user.tier or "N/A", user.points]
+            for user in users)
+    print_paginated(rows, headers)
 
 
 def reset_password():
     try:
         username = input("Enter the username for which you want to reset the password: ")
 
-        for user in users:
-            if user.username == username:
-                old_password = user.password  # Save the old password
+        user = users.get(username)
+        if not user:
+            print("\n** Username not found. **")
+            return
 
-                while True:
-                    print("\nPassword requirements:")
-                    print("- At least 8 characters long")
-                    print("- Contains at least one uppercase letter")
-                    print("- Contains at least one lowercase letter")
-                    print("- Contains at least one digit")
-                    print("- Contains at least one special character (!@#$%^&*(),.?\":{}|<>)")
-
-                    new_password = input("Enter the new password or type 'B' to go back to main menu: ")
-                    if new_password.upper() == 'B':
-                        return
+        while True:
+            print("\nPassword requirements:")
+            print("- At least 8 characters long")
+            print("- Contains at least one uppercase letter")
+            print("- Contains at least one lowercase letter")
+            print("- Contains at least one digit")
+            print("- Contains at least one special character (!@#$%^&*(),.?\":{}|<>)")
+
+            new_password = input("Enter the new password or type 'B' to go back to main menu: ")
+            if new_password.upper() == 'B':
+                return
 
-                    # Validate password complexity
-                    if len(new_password) < 8:
-                        print("\n** Password must be at least 8 characters long. **")
-                        continue
-                    if not re.search(r"[A-Z]", new_password):
-                        print("\n** Password must contain at least one uppercase letter. **")
-                        continue
-                    if not re.search(r"[a-z]", new_password):
-                        print("\n** Password must contain at least one lowercase letter. **")
-                        continue
-                    if not re.search(r"\d", new_password):
-                        print("\n** Password must contain at least one digit. **")
-                        continue
-                    if not re.search(r"[!@#$%^&*(),.?\":{}|<>]", new_password):
-                        print("\n** Password must contain at least one special character. **")
-                        continue
+            # Validate password complexity
+            if len(new_password) < 8:
+                print("\n** Password must be at least 8 characters long. **")
+                continue
+            if not re.search(r"[A-Z]", new_password):
+                print("\n** Password must contain at least one uppercase letter. **")
+                continue
+            if not re.search(r"[a-z]", new_password):
+                print("\n** Password must contain at least one lowercase letter. **")
+                continue
+            if not re.search(r"\d", new_password):
+                print("\n** Password must contain at least one digit. **")
+                continue
+            if not re.search(r"[!@#$%^&*(),.?\":{}|<>]", new_password):
+                print("\n** Password must contain at least one special character. **")
+                continue
 
-                    break
+            break
 
+        try:
+            # The stored user is the current one; another terminal may have changed or deleted it meanwhile
+            with store.transaction():
+                user = store.get(store.user_key(username))
+                if user is None:
+                    print("\n** Username not found. **")
+                    return
+                old_password = user.password
                 user.password = new_password
+                store.put_user(user, 'reset_password')
+                cached = user_cache.get().get(username)
+                if cached is not None:
+                    cached.password = new_password
+        except IOError as ioe:
+            print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
+            logging.error(f"An I/O error occurred while accessing the database: {ioe}")
+            return  # Exit the function if there's an I/O error
 
-                try:
-                    with shelve.open('book_management_db') as db:
-                        db['users'] = users
-                except IOError as ioe:
-                    print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-                    logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-                    return  # Exit the function if there's an I/O error
-
-                # Push the operation to the stack
-                operation_stack.push(('reset_password', username, old_password))
-
-                print(f"\n-- Password for user '{username}' has been reset. --")
-                logging.info(f"Password for user '{username}' was reset by the admin.")
-                return
+        # Push the operation to the stack
+        operation_stack.push(('reset_password', username, old_password))
 
-        print("\n** Username not found. **")
+        print(f"\n-- Password for user '{username}' has been reset. --")
+        logging.info(f"Password for user '{username}' was reset by the admin.")
     except Exception as e:
         print(f"An error occurred: {e}")
         logging.error(f"An error occurred: {e}")
 
 
-def quick_sort_books_by_title(books):
-    if len(books) <= 1:
-        return books
+####################################### SORT ENGINE #################################################
+# Sorting for lists of books that are not kept in a sorted index (the menu's sorted views read
+# book_indexes instead). Each algorithm computes every book's key once, sorts several keys as a tuple and
+# is stable, also with reverse. Keys are Book getter names (e.g. 'get_language') or callables taking a book.
+
+# Timsort (sorted)
+def _timsort(books, key, reverse):
+    return sorted(books, key=key, reverse=reverse)
+
+
+# Bottom-up merge sort of the book positions; iterative, so it never recurses
+def _merge_sort(books, key, reverse):
+    keys = [key(book) for book in books]
+    # A right-hand book only goes first when its key is strictly before, so equal keys keep their order
+    before = operator.gt if reverse else operator.lt
+    order = list(range(len(books)))
+    n = len(order)
+    width = 1
+    while width < n:
+        merged = []
+        for lo in range(0, n, 2 * width):
+            mid = min(lo + width, n)
+            hi = min(lo + 2 * width, n)
+            i, j = lo, mid
+            while i < mid and j < hi:
+                if before(keys[order[j]], keys[order[i]]):
+                    merged.append(order[j])
+                    j += 1
+                else:
+                    merged.append(order[i])
+                    i += 1
+            merged.extend(order[i:mid])
+            merged.extend(order[j:hi])
+        order = merged
+        width *= 2
+    return [books[index] for index in order]
+
+
+SORT_ALGORITHMS = {
+    'timsort': _timsort,
+    'merge': _merge_sort,
+}
+
+
+def sort_books(books, keys, algorithm='timsort', reverse=False):
+    if algorithm not in SORT_ALGORITHMS:
+        raise ValueError(f"Unknown sort algorithm: {algorithm}")
+    getters = [key if callable(key) else operator.methodcaller(key) for key in keys]
+    if len(getters) == 1:
+        key = getters[0]
     else:
-        pivot = books[0]
-        less_than_pivot = [book for book in books[1:] if book.get_title().lower() <= pivot.get_title().lower()]
-        greater_than_pivot = [book for book in books[1:] if book.get_title().lower() > pivot.get_title().lower()]
-        return quick_sort_books_by_title(less_than_pivot) + [pivot] + quick_sort_books_by_title(greater_than_pivot)
+        def key(book):
+            return tuple(getter(book) for getter in getters)
+    return SORT_ALGORITHMS[algorithm](list(books), key, reverse)
+
+
+# The old entry points, now thin wrappers over sort_books
+def quick_sort_books_by_title(books, algorithm='timsort'):
+    return sort_books(books, [lambda book: book.get_title().lower()], algorithm)
 
 
 def display_sorted_books_by_title(user):
     try:
         print("\n-- Sorted Books by Title in Ascending Order --\n")
         if is_admin(user) or user.role in ["librarian", "customer"]:
-            books = []
-
-            def collect_books_inorder(node):
-                if node:
-                    collect_books_inorder(node.left)
-                    books.append(node.book)
-                    collect_books_inorder(node.right)
-
-            collect_books_inorder(book_tree.root)
-
-            sorted_books = quick_sort_books_by_title(books)
+            sorted_books = book_indexes.ordered_books('title')
 
             headers = ["ISBN", "Title", "Publisher", "Language", "Number of Copies", "Availability", "Author", "Genre",
                        "Points"]
-            table = []
-
-            for book in sorted_books:
-                table.append([
-                    book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
-                    book.get_noOfCopies(), book.get_availability(), book.get_author(), book.get_genre(),
-                    book.get_points_value()
-                ])
-
-            print(tabulate(table, headers, tablefmt="grid"))
+            print_paginated((book_row(book) for book in sorted_books), headers)
             logging.info(f"{user.username} sorted books by title in ascending order.")
         else:
             raise PermissionError("** Unauthorized access. **")
@@ -1031,68 +2953,19 @@ def display_sorted_books_by_title(user):
         print(e)
 
 
-def merge_sort_books(books, key1, key2):
-    if len(books) <= 1:
-        return books
-
-    def get_key(book, key):
-        return getattr(book, key)()
-
-    mid = len(books) // 2
-    left_half = books[:mid]
-    right_half = books[mid:]
-
-    left_sorted = merge_sort_books(left_half, key1, key2)
-    right_sorted = merge_sort_books(right_half, key1, key2)
-
-    sorted_books = []
-    i = j = 0
-
-    while i < len(left_sorted) and j < len(right_sorted):
-        if get_key(left_sorted[i], key1) < get_key(right_sorted[j], key1) or \
-                (get_key(left_sorted[i], key1) == get_key(right_sorted[j], key1) and get_key(left_sorted[i],
-                                                                                             key2) <= get_key(
-                    right_sorted[j], key2)):
-            sorted_books.append(left_sorted[i])
-            i += 1
-        else:
-            sorted_books.append(right_sorted[j])
-            j += 1
-
-    sorted_books.extend(left_sorted[i:])
-    sorted_books.extend(right_sorted[j:])
-
-    return sorted_books
+def merge_sort_books(books, key1, key2, algorithm='merge'):
+    return sort_books(books, [key1, key2], algorithm)
 
 
 def display_sorted_books_by_language_and_isbn(user):
     try:
         print("\n-- Sorted Books by Language and ISBN in Ascending Order --\n")
         if is_admin(user) or user.role in ["librarian", "customer"]:
-            books = []
-
-            def collect_books_inorder(node):
-                if node:
-                    collect_books_inorder(node.left)
-                    books.append(node.book)
-                    collect_books_inorder(node.right)
-
-            collect_books_inorder(book_tree.root)
-
-            sorted_books = merge_sort_books(books, 'get_language', 'get_isbn')
+            sorted_books = book_indexes.ordered_books('language_isbn')
 
             headers = ["ISBN", "Title", "Publisher", "Language", "Number of Copies", "Availability", "Author",
                        "Genre", "Points"]
-            table = []
-
-            for book in sorted_books:
-                table.append([
-                    book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
-                    book.get_noOfCopies(), book.get_availability(), book.get_author(), book.get_genre(),
-                    book.get_points_value()
-                ])
-
-            print(tabulate(table, headers, tablefmt="grid"))
+            print_paginated((book_row(book) for book in sorted_books), headers)
             logging.info(f"{user.username} sorted books by language and ISBN in ascending order.")
         else:
             raise PermissionError("** Unauthorized access. **")
@@ -1102,99 +2975,267 @@ def display_sorted_books_by_language_and_isbn(user):
 
 ####################################### 3A - 3D #################################################
 
-class CustomerRequest:
-    def __init__(self, customer_id, request_detail):
+class CustomerRequest(SlottedRecord):
+    __slots__ = ('customer_id', 'request_detail', 'tier')
+    STATE_DEFAULTS = {'tier': 'C'}
+
+    def __init__(self, customer_id, request_detail, tier='C'):
         self.customer_id = customer_id
         self.request_detail = request_detail
+        self.tier = tier  # customer's tier when the request was made, used by the priority queue
 
     def __repr__(self):
         return f"CustomerRequest(customer_id={self.customer_id}, request_detail={self.request_detail})"
 
 ################################# START QUEUE ##################################################
+# FIFO queue of customer requests backed by a deque. On disk every request is its own record under
+# 'customer_requests:<position>' and the 'customer_requests' key holds the head/tail positions, so an
+# enqueue or dequeue writes one request record plus the small pointer record.
+#
+# Requests are also indexed by customer_id (position -> request, in arrival order), so one customer's
+# requests can be listed, counted or removed without scanning the whole queue. Removing from the
+# middle only drops the request from the dicts; its stale position is skipped when it reaches the head.
+#
+# In 'priority' mode requests are served from a heap keyed on (position - tier head start, position).
+# A tier A request overtakes requests that arrived up to 2 * PRIORITY_AGING_WINDOW positions earlier and
+# tier B up to PRIORITY_AGING_WINDOW, so waiting tier C requests still age to the front instead of starving.
+#
+# The public reads and mutations each run as one store transaction, so with a shared store they see the
+# latest queue.
 class Queue:
-    def __init__(self):
-        self.queue = []
+    KEY = 'customer_requests'
+    MODES = ('fifo', 'priority')
+    TIER_HEAD_START = {'A': 2 * PRIORITY_AGING_WINDOW, 'B': PRIORITY_AGING_WINDOW, 'C': 0}
+
+    def __init__(self, mode=REQUEST_QUEUE_MODE):
+        self.order = deque()  # positions in arrival order, may contain removed positions
+        self.heap = []  # (priority, position) in priority mode, may contain removed positions
+        self.requests = {}  # position -> request for every live request
+        self.by_customer = {}  # customer_id -> {position: request}
+        self.head = 0
+        self.tail = 0
+        self.mode = mode
         self.load_queue()
 
+    def _entry_key(self, position):
+        return f"{self.KEY}:{position}"
+
     def load_queue(self):
         try:
-            with shelve.open('book_management_db') as db:
-                self.queue = db.get('customer_requests', [])
+            pointers = store.get(self.KEY)
+            if isinstance(pointers, list):
+                self._migrate_legacy(pointers)
+                return
+            pointers = pointers or {'head': 0, 'tail': 0}
+            self._reset()
+            self.head, self.tail = pointers['head'], pointers['tail']
+            self.mode = pointers.get('mode', self.mode)
+            for position in range(self.head, self.tail):
+                request = store.get(self._entry_key(position))
+                if request is not None:
+                    self._index(position, request)
         except IOError as ioe:
             print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
             logging.error(f"An I/O error occurred while accessing the database: {ioe}")
 
+    # Converts the old pickled list under 'customer_requests' into per-request records
+    def _migrate_legacy(self, requests):
+        self._reset()
+        self.head = self.tail = 0
+        for request in requests:
+            self._append(request)
+        self.save_queue()
+        logging.info("Migrated 'customer_requests' into per-request records.")
+
     def save_queue(self):
         try:
-            with shelve.open('book_management_db') as db:
-                db['customer_requests'] = self.queue
+            store.put(self.KEY, {'head': self.head, 'tail': self.tail, 'mode': self.mode})
         except IOError as ioe:
             print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
             logging.error(f"An I/O error occurred while accessing the database: {ioe}")
 
+    def _reset(self):
+        self.order.clear()
+        self.heap.clear()
+        self.requests.clear()
+        self.by_customer.clear()
+
+    def _priority(self, position, request):
+        return position - self.TIER_HEAD_START.get(getattr(request, 'tier', 'C'), 0)
+
+    def _index(self, position, request):
+        self.order.append(position)
+        if self.mode == 'priority':
+            heapq.heappush(self.heap, (self._priority(position, request), position))
+        self.requests[position] = request
+        self.by_customer.setdefault(request.customer_id, {})[position] = request
+
+    # Switches between FIFO and tier-priority service, rebuilding the heap from the live requests
+    def set_mode(self, mode):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown queue mode: {mode}")
+        with store.transaction():
+            self.mode = mode
+            self.heap = [(self._priority(position, request), position)
+                         for position, request in self.requests.items()]
+            heapq.heapify(self.heap)
+            self.save_queue()
+
+    # Position of the request that will be served next
+    def _next_position(self):
+        if self.mode == 'priority':
+            while self.heap[0][1] not in self.requests:
+                heapq.heappop(self.heap)
+            return self.heap[0][1]
+        self._advance_head()
+        return self.order[0]
+
+    def _unindex(self, position):
+        request = self.requests.pop(position)
+        customer_requests = self.by_customer[request.customer_id]
+        del customer_requests[position]
+        if not customer_requests:
+            del self.by_customer[request.customer_id]
+        return request
+
+    # Drops removed positions from the front so order[0] is the live head
+    def _advance_head(self):
+        while self.order and self.order[0] not in self.requests:
+            self.order.popleft()
+        self.head = self.order[0] if self.order else self.tail
+
+    def _append(self, item):
+        position = self.tail
+        self.tail += 1
+        self._index(position, item)
+        store.put(self._entry_key(position), item)
+        return position
+
+    def __iter__(self):
+        with store.transaction():
+            return iter(list(self.requests.values()))
+
+    # (position, request) pairs in queue order; position identifies a request for remove()
+    def entries(self):
+        with store.transaction():
+            return iter(list(self.requests.items()))
+
+    # (position, request) pairs for one customer in arrival order
+    def requests_for(self, customer_id):
+        with store.transaction():
+            return list(self.by_customer.get(customer_id, {}).items())
+
+    def count_for(self, customer_id):
+        with store.transaction():
+            return len(self.by_customer.get(customer_id, ()))
+
     def is_empty(self):
-        return len(self.queue) == 0
+        with store.transaction():
+            return len(self.requests) == 0
 
     def enqueue(self, item):
-        self.queue.append(item)
-        self.save_queue()
+        with store.transaction():
+            self._append(item)
+            self.save_queue()
 
     def dequeue(self):
-        if self.is_empty():
-            raise IndexError("Dequeue from an empty queue")
-        item = self.queue.pop(0)
-        self.save_queue()
-        return item
+        with store.transaction():
+            if self.is_empty():
+                raise IndexError("Dequeue from an empty queue")
+            position = self._next_position()
+            if self.mode == 'priority':
+                heapq.heappop(self.heap)
+            item = self._unindex(position)
+            store.delete(self._entry_key(position))
+            self._advance_head()
+            self.save_queue()
+            return item
+
+    # Removes the request at position; returns None if it is already gone (e.g. served by another terminal)
+    def remove(self, position):
+        with store.transaction():
+            if position not in self.requests:
+                return None
+            request = self._unindex(position)
+            store.delete(self._entry_key(position))
+            self._advance_head()
+            self.save_queue()
+            return request
+
+    def clear(self):
+        with store.transaction():
+            for position in self.requests:
+                store.delete(self._entry_key(position))
+            self._reset()
+            self.head = self.tail
+            self.save_queue()
 
     def peek(self):
-        if self.is_empty():
-            raise IndexError("Peek from an empty queue")
-        return self.queue[0]
+        with store.transaction():
+            if self.is_empty():
+                raise IndexError("Peek from an empty queue")
+            return self.requests[self._next_position()]
 
     def size(self):
-        return len(self.queue)
+        with store.transaction():
+            return len(self.requests)
 
 #################################### END QUEUE ###################################################
 
 
+customer_queue = Queue()
+
+
+# Store listener for the shared mode: brings the in-memory catalog, cafe menu and request queue up to date
+# with writes other processes made ({key: op} since this process last held the store lock). Users are
+# reloaded by UserCache from the users version stamp.
+def refresh_from_store(changes):
+    global menu_items
+    with library_service.catalog_lock:
+        for key, op in changes.items():
+            if not key.startswith(store.BOOK_PREFIX):
+                continue
+            isbn = int(key[len(store.BOOK_PREFIX):])
+            if isbn in booklist:
+                book_tree.delete(isbn)
+                del booklist[isbn]
+                book_indexes.discard(isbn)
+            book = store.get(key) if op == 'put' else None
+            if book is not None:
+                book_tree.insert(book)
+                booklist[isbn] = book
+                book_indexes.add(book)
+    if 'menu_items' in changes:
+        menu_items = store.get('menu_items') or menu_items
+    if any(key.startswith(Queue.KEY) for key in changes):
+        customer_queue.load_queue()
+
+
+store.add_listener(refresh_from_store)
+
+
 def view_customer_details(user):
     if user.role != "librarian":
         print("** Unauthorized access. Only librarians can view customer details. **")
         return
 
-    try:
-        with shelve.open('book_management_db') as db:
-            queue = db.get('customer_requests', [])
-    except IOError as ioe:
-        print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
-        logging.error(f"An I/O error occurred while accessing the database: {ioe}")
-        return  # Exit the function if there's an I/O error
-
-    customer_requests = {}
-    for request in queue:
-        if request.customer_id in customer_requests:
-            customer_requests[request.customer_id].append(request.request_detail)
-        else:
-            customer_requests[request.customer_id] = [request.request_detail]
-
     headers = ["Customer ID", "Name", "Email", "Tier", "Points", "Requests"]
-    table = []
 
-    print("\n-- List of all customers and their details with Requests: --\n")
-    for user in users:
-        if user.role == "customer":
-            requests = "\n".join(customer_requests.get(user.customer_id, ["No requests"]))
-            table.append([user.customer_id, user.username, user.email, user.tier, user.points, requests])
+    def customer_rows():
+        for customer in users:
+            if customer.role == "customer":
+                requests = "\n".join(request.request_detail for position, request in
+                                      customer_queue.requests_for(customer.customer_id)) or "No requests"
+                yield [customer.customer_id, customer.username, customer.email, customer.tier, customer.points,
+                       requests]
 
-    print(tabulate(table, headers, tablefmt="grid"))
+    print("\n-- List of all customers and their details with Requests: --\n")
+    print_paginated(customer_rows(), headers)
 
 
 
 def sequential_search(queue, customer_id):
-    for request in queue.queue:
-        if request.customer_id == customer_id:
-            return True
-    return False
+    return queue.count_for(customer_id) > 0
 
 
 def delete_customer_request_by_id(user):
@@ -1205,37 +3246,35 @@ def delete_customer_request_by_id(user):
     customer_id = input("Enter the Customer ID for the request to delete: ")
 
     try:
-        with shelve.open('book_management_db', writeback=True) as db:
-            queue = db.get('customer_requests', [])
-
-            filtered_requests = [req for req in queue if req.customer_id == customer_id]
+        filtered_requests = customer_queue.requests_for(customer_id)
 
-            if not filtered_requests:
-                print("No requests found for this customer ID.")
-                return
+        if not filtered_requests:
+            print("No requests found for this customer ID.")
+            return
 
-            print("\nFound requests:")
-            for idx, req in enumerate(filtered_requests, start=1):
-                print(f"{idx}. {req.request_detail}")
+        print("\nFound requests:")
+        for idx, (position, req) in enumerate(filtered_requests, start=1):
+            print(f"{idx}. {req.request_detail}")
 
-            while True:
-                try:
-                    delete_idx = int(input("Enter the number of the request to delete (or 0 to cancel): "))
-                    if delete_idx == 0:
-                        print("-- Deletion cancelled. --")
-                        break
+        while True:
+            try:
+                delete_idx = int(input("Enter the number of the request to delete (or 0 to cancel): "))
+                if delete_idx == 0:
+                    print("-- Deletion cancelled. --")
+                    break
 
-                    if delete_idx < 1 or delete_idx > len(filtered_requests):
-                        print("Invalid index. Please select a valid number from the list.")
-                        continue
+                if delete_idx < 1 or delete_idx > len(filtered_requests):
+                    print("Invalid index. Please select a valid number from the list.")
+                    continue
 
-                    request_to_delete = filtered_requests[delete_idx - 1]
-                    queue.remove(request_to_delete)
-                    db['customer_requests'] = queue
+                position, request_to_delete = filtered_requests[delete_idx - 1]
+                if customer_queue.remove(position) is None:
+                    print("\n** That request has already been removed. **")
+                else:
                     print("Request deleted successfully.")
-                    break
-                except ValueError:
-                    print("Invalid input. Please enter a valid number.")
+                break
+            except ValueError:
+                print("Invalid input. Please enter a valid number.")
     except IOError as ioe:
         print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
         logging.error(f"An I/O error occurred while accessing the database: {ioe}")
@@ -1250,12 +3289,8 @@ def delete_all_customer_requests(user):
     confirmation = input("Are you sure you want to delete ALL customer requests? Type 'yes' to confirm: ").lower()
     if confirmation == 'yes':
         try:
-            with shelve.open('book_management_db', writeback=True) as db:
-                db['customer_requests'] = []
-                print("All customer requests have been successfully deleted.")
-                queue = Queue()
-                queue.queue.clear()
-                queue.save_queue()
+            customer_queue.clear()
+            print("All customer requests have been successfully deleted.")
         except IOError as ioe:
             print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
             logging.error(f"An I/O error occurred while accessing the database: {ioe}")
@@ -1269,7 +3304,7 @@ def manage_customer_requests(user):
         print("** Unauthorized access. Only librarians can manage customer requests. **")
         return
 
-    queue = Queue()
+    queue = customer_queue
 
     while True:
         print("\nCustomer Request Menu:")
@@ -1279,6 +3314,7 @@ def manage_customer_requests(user):
         print("4. Service next request in Queue")
         print("5. Delete customer request")
         print("6. Delete all customer requests")
+        print(f"7. Switch service order (currently {'tier priority' if queue.mode == 'priority' else 'first come, first served'})")
         print("0. Return to Main Menu")
         choice = input("Please select one: ")
 
@@ -1300,21 +3336,21 @@ def manage_customer_requests(user):
                 if request_detail == "B":
                     break
 
-                request = CustomerRequest(customer_id, request_detail)
+                request = CustomerRequest(customer_id, request_detail, users.get_by_customer_id(customer_id).tier)
                 queue.enqueue(request)
                 print("Customer's request added successfully!")
                 break
 
         elif choice == '3':
-            queue.load_queue()
             print(f"Number of customer requests: {queue.size()}")
 
         elif choice == '4':
-            if queue.is_empty():
+            try:
+                processed_request = queue.dequeue()
+            except IndexError:
                 print("No requests to process.")
             else:
-                processed_request = queue.dequeue()
-                customer = next((user for user in users if user.customer_id == processed_request.customer_id), None)
+                customer = users.get_by_customer_id(processed_request.customer_id)
                 print("\nCustomer Request Details:")
                 print("--------------------------------------------------")
                 if customer:
@@ -1334,6 +3370,10 @@ def manage_customer_requests(user):
         elif choice == '6':
             delete_all_customer_requests(user)
 
+        elif choice == '7':
+            queue.set_mode('fifo' if queue.mode == 'priority' else 'priority')
+            print(f"Requests will now be served in {'tier priority' if queue.mode == 'priority' else 'first come, first served'} order.")
+
         elif choice == '0':
             print("Returning to Main Menu.")
             break
@@ -1344,9 +3384,7 @@ def manage_customer_requests(user):
 
 def validate_customer_id(customer_id):
     try:
-        with shelve.open('book_management_db') as db:
-            users = db.get('users', [])
-            return any(user.customer_id == customer_id for user in users if hasattr(user, 'customer_id'))
+        return users.get_by_customer_id(customer_id) is not None
     except IOError as ioe:
         print(f"\n** An I/O error occurred while accessing the database: {ioe} **")
         logging.error(f"An I/O error occurred while accessing the database: {ioe}")
@@ -1357,306 +3395,873 @@ def validate_customer_id(customer_id):
 ########################### END OF 3A - 3D ###################################
 
 
-########################### TEST PROGRAM ###################################
+########################### BULK IMPORT ###################################
+
+IMPORT_FIELDS = ('isbn', 'title', 'publisher', 'language', 'copies', 'availability', 'author', 'genre', 'points')
+
+
+# Streams raw records from a CSV file (with a header row) or a JSON Lines file
+def read_import_records(path, file_format=None):
+    if file_format is None:
+        file_format = 'jsonl' if path.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+    with open(path, newline='', encoding='utf-8') as feed:
+        if file_format == 'csv':
+            yield from csv.DictReader(feed)
+        else:
+            for line in feed:
+                if line.strip():
+                    yield json.loads(line)
+
+
+# Builds a Book from one feed record, raising ValueError/KeyError/TypeError if it is malformed
+def parse_import_record(record):
+    isbn = int(record['isbn'])
+    if not 0 < isbn < 10 ** 13:
+        raise ValueError("ISBN must be a positive number of at most 13 digits")
+    title = str(record['title']).strip()
+    if not title:
+        raise ValueError("missing title")
+    copies = int(record.get('copies') or 0)
+    if copies < 0:
+        raise ValueError("negative number of copies")
+    availability = record.get('availability')
+    availability = copies > 0 if availability is None or availability == '' else parse_flag(availability)
+    return Book(isbn, title, str(record.get('publisher') or ''), str(record.get('language') or ''), copies,
+                availability, str(record.get('author') or ''), str(record.get('genre') or ''),
+                int(record.get('points') or 0))
+
+
+# Loads a publisher feed into the catalog. Records are validated as they stream in (ISBNs must be new to
+# the tree and unique within the feed) and written to the store in batches of batch_size. The tree is then
+# rebuilt lazily over the merged ISBNs of the old and new books, so no book is loaded for it, and the
+# secondary indexes are bulk-loaded. Returns (imported, skipped).
+def import_books(path, file_format=None, batch_size=IMPORT_BATCH):
+    imported = []
+    batch = []
+    seen = set()
+    skipped = 0
+    try:
+        for line_number, record in enumerate(read_import_records(path, file_format), start=1):
+            try:
+                book = parse_import_record(record)
+            except (ValueError, KeyError, TypeError, OverflowError) as e:
+                skipped += 1
+                logging.error(f"Import {path} record {line_number} skipped: invalid record ({e}).")
+                continue
+            isbn = book.get_isbn()
+            if isbn in seen or book_tree.search(isbn):
+                skipped += 1
+                logging.error(f"Import {path} record {line_number} skipped: ISBN {isbn} already exists.")
+                continue
+            seen.add(isbn)
+            imported.append(book)
+            batch.append(book)
+            if len(batch) >= batch_size:
+                store.put_books_batch(batch)
+                batch = []
+                print(f"-- {len(imported)} books imported so far --")
+        if batch:
+            store.put_books_batch(batch)
+    except (IOError, OSError, json.JSONDecodeError, csv.Error) as e:
+        print(f"\n** An error occurred while importing {path}: {e} **")
+        logging.error(f"An error occurred while importing {path}: {e}")
+
+    # Books already committed stay in the catalog even if the feed failed part way
+    if imported:
+        imported.sort(key=Book.get_isbn)
+        booklist.update((book.get_isbn(), book) for book in imported)
+        book_tree.build_lazy(array('q', heapq.merge(book_tree.iter_keys(), (book.get_isbn() for book in imported))),
+                             booklist.__getitem__)
+        book_indexes.add_many(imported)
+    print(f"\n-- Imported {len(imported)} books, skipped {skipped} records. --")
+    logging.info(f"Imported {len(imported)} books from {path}, skipped {skipped} records.")
+    return len(imported), skipped
+
+
+########################### EXPORT ###################################
+
+USER_EXPORT_FIELDS = ('username', 'role', 'customer_id', 'email', 'points', 'tier')  # passwords are never exported
+REQUEST_EXPORT_FIELDS = ('position', 'customer_id', 'request_detail', 'tier')
+
+
+def book_export_row(book):
+    return dict(zip(IMPORT_FIELDS, (book.get_isbn(), book.get_title(), book.get_publisher(), book.get_language(),
+                                    book.get_noOfCopies(), book.get_availability(), book.get_author(),
+                                    book.get_genre(), book.get_points_value())))
+
+
+def user_export_row(user):
+    return {field: getattr(user, field, None) for field in USER_EXPORT_FIELDS}
+
+
+def request_export_row(position, request):
+    return {'position': position, 'customer_id': request.customer_id, 'request_detail': request.request_detail,
+            'tier': getattr(request, 'tier', 'C')}
+
+
+# dataset -> (store key prefix, columns, id column, id parser, row builder taking (id, record))
+EXPORT_DATASETS = {
+    'books': (LibraryStore.BOOK_PREFIX, IMPORT_FIELDS, 'isbn', int, lambda isbn, book: book_export_row(book)),
+    'users': (LibraryStore.USER_PREFIX, USER_EXPORT_FIELDS, 'username', str,
+              lambda username, user: user_export_row(user)),
+    'requests': (f"{Queue.KEY}:", REQUEST_EXPORT_FIELDS, 'position', int, request_export_row),
+}
+
+
+# Yields one row per record of the dataset. With since, only records changed after that sequence are
+# yielded, each with an 'op' column ('upsert', or 'delete' with just the id for records since removed).
+# since_offset is the journal offset recorded with since, so the journal is only read from there.
+def export_rows(dataset, since=None, since_offset=0):
+    prefix, fields, id_field, parse_id, to_row = EXPORT_DATASETS[dataset]
+    if since is None:
+        for key, record in store.iter_records(prefix):
+            yield to_row(parse_id(key[len(prefix):]), record)
+        return
+    for key, op in store.changes_since(since, prefix, since_offset).items():
+        record_id = parse_id(key[len(prefix):])
+        record = store.get(key) if op == 'put' else None
+        if record is None:
+            yield {id_field: record_id, 'op': 'delete'}
+        else:
+            row = to_row(record_id, record)
+            row['op'] = 'upsert'
+            yield row
+
+
+def _write_export_file(path, rows, file_format, fields):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as export_file:
+        if file_format == 'csv':
+            writer = csv.DictWriter(export_file, fields)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                export_file.write(json.dumps(row) + '\n')
+                count += 1
+    return count
+
+
+# Streams rows into numbered files of at most chunk_rows rows each; returns [{'file', 'rows'}]
+def write_export_chunks(rows, directory, dataset, file_format, fields, chunk_rows):
+    rows = iter(rows)
+    chunks = []
+    for first in rows:
+        name = f"{dataset}-{len(chunks) + 1:05d}.{file_format}"
+        count = _write_export_file(os.path.join(directory, name), itertools.chain([first],
+                                   itertools.islice(rows, chunk_rows - 1)), file_format, fields)
+        chunks.append({'file': name, 'rows': count})
+    return chunks
+
+
+# Exports a dataset to chunked CSV/JSON Lines files plus a <dataset>-manifest.json. The manifest's 'seq'
+# is the change sequence the export started from and 'journal_offset' the change journal position at that
+# point; pass them as since and since_offset next time to export only what changed.
+def export_dataset(dataset, directory, file_format='jsonl', since=None, chunk_rows=EXPORT_CHUNK_ROWS,
+                   since_offset=0):
+    fields = EXPORT_DATASETS[dataset][1] + (('op',) if since is not None else ())
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # The offset is taken first so that it never covers changes after seq
+        offset = store.journal_position()
+        seq = store.change_seq()
+        chunks = write_export_chunks(export_rows(dataset, since, since_offset), directory, dataset, file_format,
+                                     fields, chunk_rows)
+        manifest = {'dataset': dataset, 'format': file_format, 'since': since, 'seq': seq, 'journal_offset': offset,
+                    'rows': sum(chunk['rows'] for chunk in chunks), 'chunks': chunks}
+        with open(os.path.join(directory, f"{dataset}-manifest.json"), 'w', encoding='utf-8') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+    except (IOError, OSError) as e:
+        print(f"\n** An error occurred while exporting {dataset}: {e} **")
+        logging.error(f"An error occurred while exporting {dataset}: {e}")
+        return None
+    print(f"-- Exported {manifest['rows']} {dataset} rows in {len(chunks)} files (change sequence {seq}). --")
+    logging.info(f"Exported {manifest['rows']} {dataset} rows to {directory} since {since} at sequence {seq}.")
+    return manifest
+
+
+########################### STORE MIGRATION ###################################
+
+# Copies the open store (every book, user, request and setting, plus the change sequence) into the files
+# of another backend, e.g. from the book_management_db shelve files to book_management_db.sqlite. The
+# write-ahead log, change journal and catalog record file are shared by both backends and carry over as they
+# are. Afterwards run with LIBRARY_STORAGE=<target>. Returns the number of records copied.
+def migrate_store(target):
+    if target == store.backend:
+        print(f"\n** The store already uses the {target} backend. **")
+        return None
+    try:
+        destination = open_backend(target, store.path)
+        try:
+            if len(destination):
+                print(f"\n** The {target} store at {store.path} already holds records; remove it first. **")
+                return None
+            copied = store.copy_to(destination)
+        finally:
+            destination.close()
+    except (IOError, OSError, sqlite3.Error) as e:
+        print(f"\n** An error occurred while migrating the store: {e} **")
+        logging.error(f"An error occurred while migrating the store to {target}: {e}")
+        return None
+    print(f"-- Copied {copied} records from the {store.backend} store to the {target} store. --")
+    print(f"-- Set LIBRARY_STORAGE={target} to use it. --")
+    logging.info(f"Migrated {copied} records from the {store.backend} store to the {target} store.")
+    return copied
+
+
+########################### NETWORK SERVICE ###################################
+
+# Largest page a client can ask for in one request
+MAX_PAGE_SIZE = 500
+
+
+# JSON Lines front end over the service layer. Each line a client sends is one request,
+# {"id": ..., "op": "<operation>", "args": {...}}, and gets one response line, {"id": ..., "ok": true,
+# "result": ...} or {"id": ..., "ok": false, "error": "..."}. Operations are the op_* methods; a
+# connection logs in once and its later requests run as that user. As in the menu, every operation but
+# login needs a logged in user. One asyncio event loop handles every
+# connection, and requests run on a pool of worker threads (the service does its own locking), so one
+# process serves many kiosks and staff clients at once.
+class LibraryServer:
+    def __init__(self, service, host='127.0.0.1', port=8765, workers=SERVICE_WORKERS):
+        self.service = service
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='library-service')
+
+    @staticmethod
+    def _user(session):
+        if session['user'] is None:
+            raise ServiceError("Please log in first.")
+        return session['user']
+
+    @staticmethod
+    def _limit(limit):
+        return max(0, min(int(limit), MAX_PAGE_SIZE))
+
+    def op_login(self, session, username, password):
+        session['user'] = self.service.login(username, password)
+        return user_export_row(session['user'])
+
+    def op_logout(self, session):
+        session['user'] = None
+
+    def op_books(self, session, after=None, limit=PAGE_SIZE):
+        self._user(session)
+        return [book_export_row(book) for book in self.service.list_books(after, self._limit(limit))]
+
+    def op_book(self, session, isbn):
+        self._user(session)
+        return book_export_row(self.service.get_book(int(isbn)))
+
+    def op_sorted(self, session, order, offset=0, limit=PAGE_SIZE):
+        self._user(session)
+        books = self.service.sorted_books(order, max(0, int(offset)), self._limit(limit))
+        return [book_export_row(book) for book in books]
+
+    def op_search(self, session, query, limit=PAGE_SIZE):
+        self._user(session)
+        return [book_export_row(book) for book in self.service.search_books(str(query), self._limit(limit))]
+
+    # Takes the bulk import's book fields (isbn, title, ..., points)
+    def op_add_book(self, session, **fields):
+        try:
+            book = parse_import_record(fields)
+        except KeyError as e:
+            raise ServiceError(f"Missing book field {e}.")
+        return book_export_row(self.service.add_book(self._user(session), book))
+
+    def op_update_book(self, session, isbn, changes):
+        self.service.update_book(self._user(session), int(isbn), dict(changes))
+        return book_export_row(self.service.get_book(int(isbn)))
+
+    def op_delete_book(self, session, isbn):
+        return book_export_row(self.service.delete_book(self._user(session), int(isbn)))
 
+    def op_borrow(self, session, isbn, copies=1):
+        book = self.service.borrow_book(self._user(session), int(isbn), int(copies))
+        return {'book': book_export_row(book), 'points': session['user'].points}
 
-while True:
-    users = initialize_users()
+    def op_cafe_menu(self, session):
+        self._user(session)
+        return [{'name': item.name, 'points': item.points} for item in self.service.cafe_menu()]
 
-    print("\n\nWelcome to the Book Management System!")
-    print("\nInput 1 to log in \nInput 2 to create a new account \nInput 3 to exit")
-    choice = input("\nEnter your choice: ")
+    def op_order(self, session, item):
+        ordered = self.service.order_from_cafe(self._user(session), str(item))
+        return {'item': ordered.name, 'points': session['user'].points}
 
-    if choice == "1":
-        print("\n-- Please log in or press 'B' on username or password to go back to Welcome Page. --\n")
-        username = input("Enter username: ")
-        if username.upper() == 'B':
-            continue
-        password = input("Enter password: ")
-        if password.upper() == 'B':
-            continue
-        user = authenticate(username, password)
-        if user:
+    def dispatch(self, session, line):
+        try:
+            request = json.loads(line)
+        except ValueError:
+            return {'id': None, 'ok': False, 'error': "Request is not valid JSON."}
+        if not isinstance(request, dict):
+            return {'id': None, 'ok': False, 'error': "Request must be a JSON object."}
+        request_id = request.get('id')
+        op = request.get('op')
+        args = request.get('args') or {}
+        handler = getattr(self, f"op_{op}", None) if isinstance(op, str) else None
+        if handler is None or not isinstance(args, dict):
+            return {'id': request_id, 'ok': False, 'error': f"Unknown operation '{op}'."}
+        try:
+            return {'id': request_id, 'ok': True, 'result': handler(session, **args)}
+        except ServiceError as e:
+            return {'id': request_id, 'ok': False, 'error': str(e)}
+        except (TypeError, ValueError, OverflowError):
+            return {'id': request_id, 'ok': False, 'error': f"Invalid arguments for '{op}'."}
+        except Exception as e:
+            # Anything else is a bug or a store failure; the client still gets its response line
+            logging.error(f"Request '{op}' failed: {e}")
+            return {'id': request_id, 'ok': False, 'error': f"The '{op}' request failed."}
+
+    async def handle_client(self, reader, writer):
+        session = {'user': None}
+        try:
             while True:
-                print(f"\n\nWelcome, {user.username}!! :)")
-                if user.role == "customer":
-                    print("ID", user.customer_id)
-                    print("Points:", user.points)  # Display customer points
-
-                if user.role == "admin":
-                    print("\n-- Welcome to Book Management System's Main Menu --")
-                    print("\nWhat would you like to do today?\n")
-                    print("\nInput 1 to display all books \n"
-                          "Input 2 to add a new book record \n"
-                          "Input 3 to update a book record \n"
-                          "Input 4 to delete a book record \n"
-                          "Input 5 to sort books by publisher \n"
-                          "Input 6 to sort books by number of copies \n"
-                          "Input 7 to sort books by Title \n"
-                          "Input 8 to sort books by Language and then ISBN Num \n"
-                          "Input 9 to view all users \n"
-                          "Input 10 to reset user password \n"
-                          "Input 11 to delete a user \n"
-                          "Input 12 to delete all users \n"
-                          "Input 13 to undo last operation \n"
-                          "Input 14 to log out \n"
-                          )
-                    typeInput = input("\nEnter your input: ")
-                    if typeInput not in ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14"]:
-                        print("Invalid input. Please try again.")
-                        continue
-                    if typeInput == "1":
-                        display_all_books(user)
-
-                    elif typeInput == "2":
-                        try:
-                            print("\n-- Add a book --\n ")
-                            isbn = int(input("Enter ISBN or type '-1' to go back to main menu: "))
-                            if isbn == -1:
-                                continue
-                            elif len(str(isbn)) > 13:
-                                print("\n** ISBN must have a maximum of 13 digits. **")
-                                continue
-                            title = input("Enter book title or type 'B' to go back to main menu: ")
-                            if title == 'B':
-                                continue
-                            publisher = input("Enter publisher or type 'B' to go back to main menu: ")
-                            if publisher == 'B':
-                                continue
-                            language = input("Enter language or type 'B' to go back to main menu: ")
-                            if language == 'B':
-                                continue
-                            noOfCopies = int(input("Enter number of copies or type '-1' to go back to main menu: "))
-                            if noOfCopies == -1:
-                                continue
-                            while noOfCopies < 0:
-                                noOfCopies = int(input("Enter number of copies (value more 0 or more): "))
-                            availability = input(
-                                "Enter availability (Y/N) or type 'B' to go back to main menu: ").upper() == "Y"
-                            if availability == 'B':
-                                continue
-                            author = input("Enter author or type 'B' to go back to main menu: ")
-                            if author == 'B':
-                                continue
-                            genre = input("Enter genre or type 'B' to go back to main menu: ")
-                            if genre == 'B':
-                                continue
-                            add_new_book(user, isbn, title, publisher, language, noOfCopies, availability, author,
-                                         genre)
-                        except ValueError:
-                            print(
-                                "\n** Invalid input. Please enter a valid number for ISBN and/or number of copies. **")
-
-                    elif typeInput == "3":
-                        try:
-                            print("\n -- Update a book --\n")
-                            isbn = int(input("Enter ISBN of the book to update or type '-1' to go back to main menu: "))
-                            if isbn == -1:
-                                continue
-                            update_book(user, isbn)
-                        except ValueError:
-                            print("\n** Invalid input. Please enter a valid number for ISBN. **")
-
-                    elif typeInput == "4":
-                        try:
-                            print("\n -- Delete a book --\n")
-                            isbn = int(input("Enter ISBN of the book to delete or type '-1' to go back to main menu: "))
-                            if isbn == -1:
-                                continue
-                            delete_book(user, isbn)
-                        except ValueError:
-                            print("\n** Invalid input. Please enter a valid number for ISBN. **")
-                    elif typeInput == "5":
-                        sort_book_publisher(user)
-
-                    elif typeInput == "6":
-                        sort_noOfCopies(user)
-
-                    elif typeInput == "7":
-                        display_sorted_books_by_title(user)
-
-                    elif typeInput == "8":
-                        display_sorted_books_by_language_and_isbn(user)
-
-                    elif typeInput == "9":
-                        view_all_users()
-
-                    elif typeInput == "10":
-                        reset_password()
-
-                    elif typeInput == "11":
-                        delete_user(user)
-
-                    elif typeInput == "12":
-                        delete_all_users(user)
-
-                    elif typeInput == "13":
-                        undo_last_operation(user)
-
-                    elif typeInput == "14":
-                        print("Logged Out")
-                        user = None
-                        break
-
-                elif user.role == "librarian":
-                    print("\n Welcome to Book Management System's Main Menu")
-                    print("\nInput 1 to display all books \n"
-                          "Input 2 to add a new book record \n"
-                          "Input 3 to update a book record \n"
-                          "Input 4 to delete a book record \n"
-                          "Input 5 to sort books by publisher \n"
-                          "Input 6 to sort books by number of copies \n"
-                          "Input 7 to sort books by Title \n"
-                          "Input 8 to sort books by Language and then ISBN Num \n"
-                          "Input 9 to manage customer requests \n"
-                          "Input 10 to undo last operation \n"
-                          "Input 11 to log out \n"
-                          )
-                    typeInput = input("\nEnter your input: ")
-                    if typeInput not in ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11"]:
-                        print("Invalid input. Please try again.")
-                        continue
-                    if typeInput == "1":
-                        display_all_books(user)
-                    elif typeInput == "2":
-                        try:
-                            isbn = int(input("Enter ISBN or type '-1' to go back  to main page: "))
-                            if isbn == -1:
-                                continue
-                            elif len(str(isbn)) > 13:
-                                print("** ISBN must have a maximum of 13 digits. **")
-                                continue
-                            title = input("Enter book title or type 'B' to go back to main menu: ")
-                            if title == 'B':
-                                continue
-                            publisher = input("Enter publisher or type 'B' to go back to main menu: ")
-                            if publisher == 'B':
-                                continue
-                            language = input("Enter language or type 'B' to go back to main menu: ")
-                            if language == 'B':
-                                continue
-                            noOfCopies = int(input("Enter number of copies or type '-1' to go back to main menu: "))
-                            if noOfCopies == -1:
-                                continue
-                            while noOfCopies < 0:
-                                noOfCopies = int(input("Enter number of copies (value more 0 or more): "))
-                            availability = input(
-                                "Enter availability (Y/N) or type 'B' to go back to main menu: ").upper() == "Y"
-                            if availability == 'B':
-                                continue
-                            author = input("Enter author or type 'B' to go back to main menu: ")
-                            if author == 'B':
-                                continue
-                            genre = input("Enter genre or type 'B' to go back to main menu: ")
-                            if genre == 'B':
-                                continue
-                            add_new_book(user, isbn, title, publisher, language, noOfCopies, availability, author,
-                                         genre)
-                        except ValueError:
-                            print(
-                                "\n** Invalid input. Please enter a valid number for ISBN and/or number of copies. **")
-
-                    elif typeInput == "3":
-                        try:
-                            print("\n -- Update a book --\n")
-                            isbn = int(input("Enter ISBN of the book to update or type '-1' to go back to main menu: "))
-                            if isbn == -1:
-                                continue
-                            update_book(user, isbn)
-                        except ValueError:
-                            print("\n** Invalid input. Please enter a valid number for ISBN. **")
-
-                    elif typeInput == "4":
-                        try:
-                            isbn = int(input("Enter ISBN of the book to delete or type '-1' to go back to main menu: "))
-                            if isbn == -1:
-                                continue
-                            delete_book(user, isbn)
-                        except ValueError:
-                            print("\n** Invalid input. Please enter a valid number for ISBN. **")
-                    elif typeInput == "5":
-                        sort_book_publisher(user)
-                    elif typeInput == "6":
-                        sort_noOfCopies(user)
-                    elif typeInput == "7":
-                        display_sorted_books_by_title(user)
-                    elif typeInput == "8":
-                        display_sorted_books_by_language_and_isbn(user)
-                    elif typeInput == "9":
-                        manage_customer_requests(user)
-                    elif typeInput == "10":
-                        undo_last_operation(user)
-                    elif typeInput == "11":
-                        print("Logged Out")
-                        user = None
-                        break
-                elif user.role == "customer":
-                    print("\n\nWelcome to Library's Main Menu")
-                    print("\nInput 1 to display all books \n"
-                          "Input 2 to search for a book by title \n"
-                          "Input 3 to sort book by publisher \n"
-                          "Input 4 to sort the book by number of copies \n"
-                          "Input 5 to sort by Title \n"
-                          "Input 6 to sort books by Language and then ISBN Number \n"
-                          "Input 7 to borrow a book \n"
-                          "Input 8 to view cafe menu \n"
-                          "Input 9 to order from cafe \n"
-                          "Input 10 to log out \n")
-                    typeInput = input("\nEnter your input: ")
-                    if typeInput not in ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10"]:
-                        print("Invalid input. Please try again.")
-                        continue
-                    if typeInput == "1":
-                        display_all_books(user)
-
-                    elif typeInput == "2":
-                        print("\n-- Search a book record --\n")
-                        search_title = input(
-                            "Enter the title of the book you want to search for or type 'B' to go back to main menu: ")
-                        if search_title == 'B':
-                            continue
-                        search_book_by_title(user, search_title)
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await asyncio.get_running_loop().run_in_executor(self.executor, self.dispatch,
+                                                                            session, line)
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            logging.error(f"Client {writer.get_extra_info('peername')} dropped: {e}")
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handle_client, self.host, self.port)
+        print(f"-- Serving the library on {self.host}:{self.port} --")
+        logging.info(f"Library service listening on {self.host}:{self.port}.")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            print("\n-- Service stopped. --")
+        finally:
+            self.executor.shutdown()
+
+
+########################### BENCHMARKS ###################################
+
+# The recursive sorts sort_books replaced, kept only as the benchmark baseline
+def _legacy_quick_sort_books_by_title(books):
+    if len(books) <= 1:
+        return books
+    else:
+        pivot = books[0]
+        less_than_pivot = [book for book in books[1:] if book.get_title().lower() <= pivot.get_title().lower()]
+        greater_than_pivot = [book for book in books[1:] if book.get_title().lower() > pivot.get_title().lower()]
+        return _legacy_quick_sort_books_by_title(less_than_pivot) + [pivot] + _legacy_quick_sort_books_by_title(
+            greater_than_pivot)
+
+
+def _legacy_merge_sort_books(books, key1, key2):
+    if len(books) <= 1:
+        return books
+
+    def get_key(book, key):
+        return getattr(book, key)()
+
+    mid = len(books) // 2
+    left_sorted = _legacy_merge_sort_books(books[:mid], key1, key2)
+    right_sorted = _legacy_merge_sort_books(books[mid:], key1, key2)
+
+    sorted_books = []
+    i = j = 0
+    while i < len(left_sorted) and j < len(right_sorted):
+        if get_key(left_sorted[i], key1) < get_key(right_sorted[j], key1) or \
+                (get_key(left_sorted[i], key1) == get_key(right_sorted[j], key1) and
+                 get_key(left_sorted[i], key2) <= get_key(right_sorted[j], key2)):
+            sorted_books.append(left_sorted[i])
+            i += 1
+        else:
+            sorted_books.append(right_sorted[j])
+            j += 1
+    sorted_books.extend(left_sorted[i:])
+    sorted_books.extend(right_sorted[j:])
+    return sorted_books
+
+
+def _synthetic_books(size, rng):
+    languages = ["en", "ml", "cl", "el", "ta", "fr"]
+    return [Book(rng.randrange(10 ** 12, 10 ** 13), ''.join(rng.choices(string.ascii_lowercase, k=10)),
+                 f"publisher {rng.randrange(500)}", rng.choice(languages), rng.randrange(100), True,
+                 f"author {rng.randrange(5000)}", "genre", rng.randrange(500))
+            for _ in range(size)]
+
+
+def _time_call(func):
+    start = time.perf_counter()
+    try:
+        func()
+    except RecursionError:
+        return None
+    return time.perf_counter() - start
+
+
+# Times the legacy title/language sorts against sort_books on random and already-sorted input
+def benchmark_sorts(sizes):
+    rng = random.Random(2852)
+    headers = ["Books", "Input", "Sort", "Implementation", "Seconds", "Speed-up"]
+    table = []
+    for size in sizes:
+        books = _synthetic_books(size, rng)
+        by_title = quick_sort_books_by_title(books)
+        cases = [
+            ("random", "title", lambda: _legacy_quick_sort_books_by_title(books),
+             lambda algorithm: quick_sort_books_by_title(books, algorithm)),
+            ("sorted", "title", lambda: _legacy_quick_sort_books_by_title(by_title),
+             lambda algorithm: quick_sort_books_by_title(by_title, algorithm)),
+            ("random", "language, ISBN", lambda: _legacy_merge_sort_books(books, 'get_language', 'get_isbn'),
+             lambda algorithm: merge_sort_books(books, 'get_language', 'get_isbn', algorithm)),
+        ]
+        for input_order, sort_name, legacy, engine in cases:
+            baseline = _time_call(legacy)
+            table.append([size, input_order, sort_name, "legacy recursive",
+                          f"{baseline:.3f}" if baseline is not None else "recursion limit", ""])
+            for algorithm in SORT_ALGORITHMS:
+                elapsed = _time_call(lambda: engine(algorithm))
+                speedup = f"{baseline / elapsed:.1f}x" if baseline is not None else "n/a"
+                table.append([size, input_order, sort_name, f"sort_books ({algorithm})", f"{elapsed:.3f}", speedup])
+    print(tabulate(table, headers, tablefmt="grid"))
+
+
+# Dict-backed layouts of the record classes from before __slots__, used as the memory benchmark baseline
+class _LegacyBook:
+    __init__ = Book.__init__
+
+
+class _LegacyUser:
+    __init__ = User.__init__
+    determine_tier = User.determine_tier
+
+
+class _LegacyBSTNode:
+    def __init__(self, book):
+        self.left = None
+        self.right = None
+        self.book = book
+        self.key = book._isbn
+        self.height = 1
+
+
+class _LegacyCustomerRequest:
+    __init__ = CustomerRequest.__init__
+
+
+def _bytes_per_record(factory, count):
+    gc.collect()
+    tracemalloc.start()
+    records = [factory(index) for index in range(count)]
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Subtract the list that holds the records
+    allocated -= sys.getsizeof(records)
+    del records
+    return allocated / count
+
+
+# Measures the per-record memory of the dict-backed and slotted record classes
+def benchmark_memory(count, sample=100000):
+    sample = min(sample, count)
+    cases = [
+        ("Book",
+         lambda i: _LegacyBook(1000000000000 + i, f"title {i}", "publisher", "en", 5, True, "author", "genre", 10),
+         lambda i: Book(1000000000000 + i, f"title {i}", "publisher", "en", 5, True, "author", "genre", 10)),
+        ("User",
+         lambda i: _LegacyUser(f"user{i}", "Password1!", "customer", f"C{i:05d}", "user@email.com"),
+         lambda i: User(f"user{i}", "Password1!", "customer", f"C{i:05d}", "user@email.com")),
+        ("BSTNode",
+         lambda i: _LegacyBSTNode(_LegacyBook(i, "", "", "", 0, True, "", "")),
+         lambda i: BSTNode(Book(i, "", "", "", 0, True, "", ""))),
+        ("CustomerRequest",
+         lambda i: _LegacyCustomerRequest(f"C{i:05d}", f"request {i}"),
+         lambda i: CustomerRequest(f"C{i:05d}", f"request {i}")),
+    ]
+    headers = ["Record", "Bytes/record (dict)", "Bytes/record (slots)", "Saved/record", f"Saved for {count:,}"]
+    table = []
+    for name, legacy, slotted in cases:
+        legacy_size = _bytes_per_record(legacy, sample)
+        slotted_size = _bytes_per_record(slotted, sample)
+        saved = legacy_size - slotted_size
+        table.append([name, f"{legacy_size:.0f}", f"{slotted_size:.0f}", f"{saved:.0f}",
+                      f"{saved * count / 2 ** 20:.1f} MiB"])
+    print(f"Per-record memory measured over {sample:,} records with tracemalloc "
+          f"(BSTNode rows include the node's Book)")
+    print(tabulate(table, headers, tablefmt="grid"))
+
+
+########################### TEST PROGRAM ###################################
 
-                    elif typeInput == "3":
-                        sort_book_publisher(user)
 
-                    elif typeInput == "4":
-                        sort_noOfCopies(user)
+def main_menu():
+    global users
+    while True:
+        users = user_cache.get()
 
-                    elif typeInput == "5":
-                        display_sorted_books_by_title(user)
+        print("\n\nWelcome to the Book Management System!")
+        print("\nInput 1 to log in \nInput 2 to create a new account \nInput 3 to exit")
+        choice = input("\nEnter your choice: ")
 
-                    elif typeInput == "6":
-                        display_sorted_books_by_language_and_isbn(user)
+        if choice == "1":
+            print("\n-- Please log in or press 'B' on username or password to go back to Welcome Page. --\n")
+            username = input("Enter username: ")
+            if username.upper() == 'B':
+                continue
+            password = input("Enter password: ")
+            if password.upper() == 'B':
+                continue
+            user = authenticate(username, password)
+            if user:
+                while True:
+                    print(f"\n\nWelcome, {user.username}!! :)")
+                    if user.role == "customer":
+                        print("ID", user.customer_id)
+                        print("Points:", user.points)  # Display customer points
+
+                    if user.role == "admin":
+                        print("\n-- Welcome to Book Management System's Main Menu --")
+                        print("\nWhat would you like to do today?\n")
+                        print("\nInput 1 to display all books \n"
+                              "Input 2 to add a new book record \n"
+                              "Input 3 to update a book record \n"
+                              "Input 4 to delete a book record \n"
+                              "Input 5 to sort books by publisher \n"
+                              "Input 6 to sort books by number of copies \n"
+                              "Input 7 to sort books by Title \n"
+                              "Input 8 to sort books by Language and then ISBN Num \n"
+                              "Input 9 to view all users \n"
+                              "Input 10 to reset user password \n"
+                              "Input 11 to delete a user \n"
+                              "Input 12 to delete all users \n"
+                              "Input 13 to undo last operation \n"
+                              "Input 14 to view the catalog report \n"
+                              "Input 15 to log out \n"
+                              )
+                        typeInput = input("\nEnter your input: ")
+                        if typeInput not in ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14",
+                                             "15"]:
+                            print("Invalid input. Please try again.")
+                            continue
+                        if typeInput == "1":
+                            display_all_books(user)
+
+                        elif typeInput == "2":
+                            try:
+                                print("\n-- Add a book --\n ")
+                                isbn = int(input("Enter ISBN or type '-1' to go back to main menu: "))
+                                if isbn == -1:
+                                    continue
+                                elif len(str(isbn)) > 13:
+                                    print("\n** ISBN must have a maximum of 13 digits. **")
+                                    continue
+                                title = input("Enter book title or type 'B' to go back to main menu: ")
+                                if title == 'B':
+                                    continue
+                                publisher = input("Enter publisher or type 'B' to go back to main menu: ")
+                                if publisher == 'B':
+                                    continue
+                                language = input("Enter language or type 'B' to go back to main menu: ")
+                                if language == 'B':
+                                    continue
+                                noOfCopies = int(input("Enter number of copies or type '-1' to go back to main menu: "))
+                                if noOfCopies == -1:
+                                    continue
+                                while noOfCopies < 0:
+                                    noOfCopies = int(input("Enter number of copies (value more 0 or more): "))
+                                availability = input(
+                                    "Enter availability (Y/N) or type 'B' to go back to main menu: ").upper() == "Y"
+                                if availability == 'B':
+                                    continue
+                                author = input("Enter author or type 'B' to go back to main menu: ")
+                                if author == 'B':
+                                    continue
+                                genre = input("Enter genre or type 'B' to go back to main menu: ")
+                                if genre == 'B':
+                                    continue
+                                add_new_book(user, isbn, title, publisher, language, noOfCopies, availability, author,
+                                             genre)
+                            except ValueError:
+                                print(
+                                    "\n** Invalid input. Please enter a valid number for ISBN and/or number of copies. **")
+
+                        elif typeInput == "3":
+                            try:
+                                print("\n -- Update a book --\n")
+                                isbn = int(input("Enter ISBN of the book to update or type '-1' to go back to main menu: "))
+                                if isbn == -1:
+                                    continue
+                                update_book(user, isbn)
+                            except ValueError:
+                                print("\n** Invalid input. Please enter a valid number for ISBN. **")
+
+                        elif typeInput == "4":
+                            try:
+                                print("\n -- Delete a book --\n")
+                                isbn = int(input("Enter ISBN of the book to delete or type '-1' to go back to main menu: "))
+                                if isbn == -1:
+                                    continue
+                                delete_book(user, isbn)
+                            except ValueError:
+                                print("\n** Invalid input. Please enter a valid number for ISBN. **")
+                        elif typeInput == "5":
+                            sort_book_publisher(user)
+
+                        elif typeInput == "6":
+                            sort_noOfCopies(user)
+
+                        elif typeInput == "7":
+                            display_sorted_books_by_title(user)
+
+                        elif typeInput == "8":
+                            display_sorted_books_by_language_and_isbn(user)
+
+                        elif typeInput == "9":
+                            view_all_users()
+
+                        elif typeInput == "10":
+                            reset_password()
+
+                        elif typeInput == "11":
+                            delete_user(user)
+
+                        elif typeInput == "12":
+                            delete_all_users(user)
+
+                        elif typeInput == "13":
+                            undo_last_operation(user)
+
+                        elif typeInput == "14":
+                            display_catalog_report(user)
+
+                        elif typeInput == "15":
+                            print("Logged Out")
+                            user = None
+                            break
 
-                    elif typeInput == "7":
-                        try:
-                            isbn = int(input(
-                                "Enter the ISBN of the book you want to borrow or type '-1' to go back to main menu: "))
-                            if isbn == -1:
+                    elif user.role == "librarian":
+                        print("\n Welcome to Book Management System's Main Menu")
+                        print("\nInput 1 to display all books \n"
+                              "Input 2 to add a new book record \n"
+                              "Input 3 to update a book record \n"
+                              "Input 4 to delete a book record \n"
+                              "Input 5 to sort books by publisher \n"
+                              "Input 6 to sort books by number of copies \n"
+                              "Input 7 to sort books by Title \n"
+                              "Input 8 to sort books by Language and then ISBN Num \n"
+                              "Input 9 to manage customer requests \n"
+                              "Input 10 to undo last operation \n"
+                              "Input 11 to view the catalog report \n"
+                              "Input 12 to log out \n"
+                              )
+                        typeInput = input("\nEnter your input: ")
+                        if typeInput not in ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12"]:
+                            print("Invalid input. Please try again.")
+                            continue
+                        if typeInput == "1":
+                            display_all_books(user)
+                        elif typeInput == "2":
+                            try:
+                                isbn = int(input("Enter ISBN or type '-1' to go back  to main page: "))
+                                if isbn == -1:
+                                    continue
+                                elif len(str(isbn)) > 13:
+                                    print("** ISBN must have a maximum of 13 digits. **")
+                                    continue
+                                title = input("Enter book title or type 'B' to go back to main menu: ")
+                                if title == 'B':
+                                    continue
+                                publisher = input("Enter publisher or type 'B' to go back to main menu: ")
+                                if publisher == 'B':
+                                    continue
+                                language = input("Enter language or type 'B' to go back to main menu: ")
+                                if language == 'B':
+                                    continue
+                                noOfCopies = int(input("Enter number of copies or type '-1' to go back to main menu: "))
+                                if noOfCopies == -1:
+                                    continue
+                                while noOfCopies < 0:
+                                    noOfCopies = int(input("Enter number of copies (value more 0 or more): "))
+                                availability = input(
+                                    "Enter availability (Y/N) or type 'B' to go back to main menu: ").upper() == "Y"
+                                if availability == 'B':
+                                    continue
+                                author = input("Enter author or type 'B' to go back to main menu: ")
+                                if author == 'B':
+                                    continue
+                                genre = input("Enter genre or type 'B' to go back to main menu: ")
+                                if genre == 'B':
+                                    continue
+                                add_new_book(user, isbn, title, publisher, language, noOfCopies, availability, author,
+                                             genre)
+                            except ValueError:
+                                print(
+                                    "\n** Invalid input. Please enter a valid number for ISBN and/or number of copies. **")
+
+                        elif typeInput == "3":
+                            try:
+                                print("\n -- Update a book --\n")
+                                isbn = int(input("Enter ISBN of the book to update or type '-1' to go back to main menu: "))
+                                if isbn == -1:
+                                    continue
+                                update_book(user, isbn)
+                            except ValueError:
+                                print("\n** Invalid input. Please enter a valid number for ISBN. **")
+
+                        elif typeInput == "4":
+                            try:
+                                isbn = int(input("Enter ISBN of the book to delete or type '-1' to go back to main menu: "))
+                                if isbn == -1:
+                                    continue
+                                delete_book(user, isbn)
+                            except ValueError:
+                                print("\n** Invalid input. Please enter a valid number for ISBN. **")
+                        elif typeInput == "5":
+                            sort_book_publisher(user)
+                        elif typeInput == "6":
+                            sort_noOfCopies(user)
+                        elif typeInput == "7":
+                            display_sorted_books_by_title(user)
+                        elif typeInput == "8":
+                            display_sorted_books_by_language_and_isbn(user)
+                        elif typeInput == "9":
+                            manage_customer_requests(user)
+                        elif typeInput == "10":
+                            undo_last_operation(user)
+                        elif typeInput == "11":
+                            display_catalog_report(user)
+                        elif typeInput == "12":
+                            print("Logged Out")
+                            user = None
+                            break
+                    elif user.role == "customer":
+                        print("\n\nWelcome to Library's Main Menu")
+                        print("\nInput 1 to display all books \n"
+                              "Input 2 to search for a book by title \n"
+                              "Input 3 to sort book by publisher \n"
+                              "Input 4 to sort the book by number of copies \n"
+                              "Input 5 to sort by Title \n"
+                              "Input 6 to sort books by Language and then ISBN Number \n"
+                              "Input 7 to borrow a book \n"
+                              "Input 8 to view cafe menu \n"
+                              "Input 9 to order from cafe \n"
+                              "Input 10 to log out \n")
+                        typeInput = input("\nEnter your input: ")
+                        if typeInput not in ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10"]:
+                            print("Invalid input. Please try again.")
+                            continue
+                        if typeInput == "1":
+                            display_all_books(user)
+
+                        elif typeInput == "2":
+                            print("\n-- Search a book record --\n")
+                            search_title = input(
+                                "Enter the title of the book you want to search for or type 'B' to go back to main menu: ")
+                            if search_title == 'B':
                                 continue
-                            else:
-                                borrow_book(user, isbn)
-                        except ValueError:
-                            print("\n** Invalid input. Please enter a valid number for ISBN. **")
+                            search_book_by_title(user, search_title)
 
-                    elif typeInput == "8":
-                        display_cafe_menu()
+                        elif typeInput == "3":
+                            sort_book_publisher(user)
 
-                    elif typeInput == "9":
-                        order_from_cafe(user)
+                        elif typeInput == "4":
+                            sort_noOfCopies(user)
 
-                    elif typeInput == "10":
-                        print("Logged Out")
-                        user = None
-                        break
+                        elif typeInput == "5":
+                            display_sorted_books_by_title(user)
+
+                        elif typeInput == "6":
+                            display_sorted_books_by_language_and_isbn(user)
+
+                        elif typeInput == "7":
+                            try:
+                                isbn = int(input(
+                                    "Enter the ISBN of the book you want to borrow or type '-1' to go back to main menu: "))
+                                if isbn == -1:
+                                    continue
+                                else:
+                                    borrow_book(user, isbn)
+                            except ValueError:
+                                print("\n** Invalid input. Please enter a valid number for ISBN. **")
+
+                        elif typeInput == "8":
+                            display_cafe_menu()
+
+                        elif typeInput == "9":
+                            order_from_cafe(user)
+
+                        elif typeInput == "10":
+                            print("Logged Out")
+                            user = None
+                            break
+            else:
+                print("\n** Invalid username or password. Please try again. **")
+        elif choice == "2":
+            new_user = create_account()
+        elif choice == "3":
+            print("\n-- Exiting the program. Goodbye! --")
+            save_catalog_records()
+            store.close()
+            break
         else:
-            print("\n** Invalid username or password. Please try again. **")
-    elif choice == "2":
-        new_user = create_account()
-    elif choice == "3":
-        print("\n-- Exiting the program. Goodbye! --")
-        break
+            print("Invalid input. Please try again.")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Book Management System")
+    subparsers = parser.add_subparsers(dest='command')
+    benchmark_parser = subparsers.add_parser('benchmark-sort',
+                                             help="time the sort_books algorithms against the legacy recursive sorts")
+    benchmark_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                                  help="catalog sizes to benchmark")
+    memory_parser = subparsers.add_parser('benchmark-memory',
+                                          help="compare per-record memory of the dict-backed and slotted records")
+    memory_parser.add_argument('--count', type=int, default=1000000, help="catalog size to extrapolate to")
+    import_parser = subparsers.add_parser('import-books', help="bulk import books from a CSV or JSON Lines feed")
+    import_parser.add_argument('path', help=f"feed file with the fields {', '.join(IMPORT_FIELDS)}")
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'], help="feed format (default: from the extension)")
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH, help="books committed per batch")
+    export_parser = subparsers.add_parser('export', help="export books, users and customer requests to chunked files")
+    export_parser.add_argument('--datasets', nargs='+', choices=list(EXPORT_DATASETS), default=list(EXPORT_DATASETS),
+                               help="datasets to export (default: all)")
+    export_parser.add_argument('--dir', default='export', help="output directory")
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'], default='jsonl', help="file format")
+    export_parser.add_argument('--since', type=int,
+                               help="only export changes after this sequence (the 'seq' of an earlier manifest)")
+    export_parser.add_argument('--since-offset', type=int, default=0,
+                               help="change journal offset recorded with --since (the 'journal_offset' of that manifest)")
+    export_parser.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS, help="rows per file")
+    migrate_parser = subparsers.add_parser('migrate-store',
+                                           help="copy the database into the files of another storage backend")
+    migrate_parser.add_argument('--to', choices=list(STORAGE_BACKENDS), default='sqlite', help="target backend")
+    serve_parser = subparsers.add_parser('serve', help="serve the library to network clients (JSON Lines over TCP)")
+    serve_parser.add_argument('--host', default='127.0.0.1', help="address to listen on")
+    serve_parser.add_argument('--port', type=int, default=8765, help="port to listen on")
+    serve_parser.add_argument('--workers', type=int, default=SERVICE_WORKERS, help="request worker threads")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'benchmark-sort':
+        benchmark_sorts(args.sizes)
+    elif args.command == 'benchmark-memory':
+        benchmark_memory(args.count)
+    elif args.command == 'import-books':
+        import_books(args.path, args.format, args.batch_size)
+    elif args.command == 'export':
+        for dataset in args.datasets:
+            export_dataset(dataset, args.dir, args.format, args.since, args.chunk_rows, args.since_offset)
+    elif args.command == 'migrate-store':
+        migrate_store(args.to)
+    elif args.command == 'serve':
+        LibraryServer(library_service, args.host, args.port, args.workers).run()
     else:
-        print("Invalid input. Please try again.")
-
+        main_menu()
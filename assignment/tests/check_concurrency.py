@@ -0,0 +1,101 @@
+# Stress check for the service layer's locking. 16 threads borrow random books and order from the cafe
+# as a handful of customers, against a fresh database in a temporary directory. Afterwards every book's
+# copies and every customer's points must match what the successful operations account for, both in
+# memory and in the store once it has been closed and reopened.
+#
+# Run: python assignment/tests/check_concurrency.py
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '234541D_ASSN.py')
+THREADS = 16
+OPERATIONS = 1000  # per thread
+BOOKS = 100
+COPIES = 4
+CUSTOMERS = 4
+
+
+# Imports the program as the module 'library' with its database files in directory
+def load_library(directory):
+    os.chdir(directory)
+    spec = importlib.util.spec_from_file_location('library', PROGRAM)
+    library = importlib.util.module_from_spec(spec)
+    sys.modules['library'] = library
+    spec.loader.exec_module(library)
+    return library
+
+
+def worker(library, customers, seed):
+    rng = random.Random(seed)
+    borrows = []  # (isbn, username, copies)
+    orders = []  # (username, points)
+    for operation in range(OPERATIONS):
+        customer = rng.choice(customers)
+        try:
+            if rng.random() < 0.7:
+                # Every thread works through the books in the same order, so they contend for the last copies
+                isbn = operation * BOOKS // OPERATIONS + 1
+                copies = rng.randint(1, 3)
+                library.library_service.borrow_book(customer, isbn, copies)
+                borrows.append((isbn, customer.username, copies))
+            else:
+                item = library.library_service.order_from_cafe(customer, rng.choice(['coffee', 'tea', 'cake']))
+                orders.append((customer.username, item.points))
+        except library.ServiceError:
+            pass
+    return borrows, orders
+
+
+def main():
+    library = load_library(tempfile.mkdtemp(prefix='library-concurrency-'))
+    admin = library.user_cache.get().get('admin')
+    for isbn in range(1, BOOKS + 1):
+        library.library_service.add_book(admin, library.Book(isbn, f"Book {isbn}", "Publisher", "en", COPIES, True,
+                                                             "Author", "Genre", isbn))
+    customers = [library.User(f"reader{number}", "Reader123!", "customer") for number in range(CUSTOMERS)]
+    directory = library.user_cache.get()
+    for customer in customers:
+        library.store.put_user(customer, 'add_user')
+        directory.add(customer)
+
+    # Switch threads as often as possible, so unlocked read-check-write sequences would interleave
+    sys.setswitchinterval(1e-6)
+    with ThreadPoolExecutor(max_workers=THREADS) as executor:
+        results = list(executor.map(lambda seed: worker(library, customers, seed), range(THREADS)))
+    borrows = [borrow for thread_borrows, _ in results for borrow in thread_borrows]
+    orders = [order for _, thread_orders in results for order in thread_orders]
+
+    expected_copies = {isbn: COPIES for isbn in range(1, BOOKS + 1)}
+    expected_points = {customer.username: 0 for customer in customers}
+    for isbn, username, copies in borrows:
+        expected_copies[isbn] -= copies
+        expected_points[username] += isbn * copies
+    for username, points in orders:
+        expected_points[username] -= points
+
+    def check(books, users, where):
+        for isbn, copies in expected_copies.items():
+            book = books(isbn)
+            assert book.get_noOfCopies() == copies >= 0, (where, isbn, book.get_noOfCopies(), copies)
+            assert (book.get_availability() == "Yes") == (copies > 0), (where, isbn, book.get_availability())
+        for username, points in expected_points.items():
+            assert users(username).points == points >= 0, (where, username, users(username).points, points)
+
+    check(library.booklist.__getitem__, directory.get, "in memory")
+    library.store.close()
+    store = library.LibraryStore()
+    try:
+        check(lambda isbn: store.get(store.book_key(isbn)), lambda username: store.get(store.user_key(username)),
+              "after reopening")
+    finally:
+        store.close()
+    print(f"-- {len(borrows)} borrows and {len(orders)} cafe orders from {THREADS} threads: copies and points "
+          f"are consistent. --")
+
+
+if __name__ == "__main__":
+    main()
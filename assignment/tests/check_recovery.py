@@ -0,0 +1,102 @@
+# Crash-recovery check for LibraryStore's write-ahead log, against a database in a temporary directory.
+# Writers run in child processes that end with os._exit, so nothing is checkpointed or closed cleanly:
+#   replay      logged but never checkpointed writes are replayed into the store at the next open,
+#               a torn record at the end of the log is ignored, and the log is emptied afterwards
+#   checkpoint  records that were already checkpointed but left in the log (a crash before truncate)
+#               are skipped by _recover, so they cannot overwrite later writes
+#
+# Run: python assignment/tests/check_recovery.py
+import importlib.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '234541D_ASSN.py')
+BOOKS = 200
+
+
+# Imports the program as the module 'library' with its own database files in directory
+def load_library(directory):
+    os.chdir(directory)
+    spec = importlib.util.spec_from_file_location('library', PROGRAM)
+    library = importlib.util.module_from_spec(spec)
+    sys.modules['library'] = library
+    spec.loader.exec_module(library)
+    return library
+
+
+def make_book(library, isbn, copies):
+    return library.Book(isbn, f"Book {isbn}", "Publisher", "en", copies, True, "Author", "Genre", 5)
+
+
+# Child process: writes to the store at path, then crashes
+def crash_writer(phase, path):
+    library = load_library(tempfile.mkdtemp(prefix='library-recovery-'))
+    store = library.LibraryStore(path, checkpoint_interval=3600)
+    if phase == 'replay':
+        for isbn in range(1, BOOKS + 1):
+            store.put_book(make_book(library, isbn, 10), 'add')
+        store.put_user(library.User("reader", "Reader123!", "customer"), 'add_user')
+        store.delete_book(BOOKS, 'delete')
+        store.wal.commit()
+    elif phase == 'checkpoint':
+        store.put_book(make_book(library, 1, 5), 'update')
+        store.wal.commit()
+        shutil.copy(f"{path}.wal", f"{path}.wal.old")
+        store.checkpoint()
+        store.put_book(make_book(library, 1, 3), 'update')
+        store.checkpoint()
+    os._exit(1)
+
+
+def run_crash_writer(phase, path):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), phase, path], capture_output=True,
+                            text=True)
+    assert result.returncode == 1, (phase, result.returncode, result.stdout, result.stderr)
+
+
+def main():
+    path = os.path.join(tempfile.mkdtemp(prefix='library-recovery-'), 'library_db')
+    library = load_library(tempfile.mkdtemp(prefix='library-recovery-'))
+
+    run_crash_writer('replay', path)
+    logged = os.path.getsize(f"{path}.wal")
+    assert logged > 0, "the crashed writer left nothing in the write-ahead log"
+    with open(f"{path}.wal", 'ab') as log_file:
+        # A record header promising 1000 bytes, cut off after 20 of them
+        log_file.write(library.WriteAheadLog.HEADER.pack(1000) + b'\x80' * 20)
+    store = library.LibraryStore(path)
+    try:
+        assert os.path.getsize(f"{path}.wal") == 0, "the log was not emptied after recovery"
+        # Every book, the user and its users version stamp, and the delete
+        replayed = store.change_seq()
+        assert replayed == BOOKS + 3, replayed
+        assert store.get(store.book_key(1)).get_noOfCopies() == 10
+        assert store.get(store.book_key(BOOKS - 1)) is not None
+        assert store.get(store.book_key(BOOKS)) is None, "the logged delete was not replayed"
+        assert store.get(store.user_key("reader")).role == "customer"
+        changes = store.changes_since(0, store.BOOK_PREFIX)
+        assert len(changes) == BOOKS and changes[store.book_key(BOOKS)] == 'delete', len(changes)
+    finally:
+        store.close()
+    print(f"-- replay: {replayed} logged writes recovered, the torn tail was ignored. --")
+
+    run_crash_writer('checkpoint', path)
+    os.replace(f"{path}.wal.old", f"{path}.wal")
+    store = library.LibraryStore(path)
+    try:
+        copies = store.get(store.book_key(1)).get_noOfCopies()
+        assert copies == 3, f"an already checkpointed record was replayed over a later write ({copies} copies)"
+        assert os.path.getsize(f"{path}.wal") == 0
+    finally:
+        store.close()
+    print("-- checkpoint: records already in the store were skipped on replay. --")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        crash_writer(sys.argv[1], sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,63 @@
+# Check for the user cache with a shared store (LIBRARY_SHARED_STORE=1), against a database in a temporary
+# directory. Another process creates a user, then this process writes one of its own users. The cache must
+# still reload for the other process's user, while a write of this process's own does not reload it.
+#
+# Run: python assignment/tests/check_shared_users.py
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '234541D_ASSN.py')
+
+
+# Imports the program as the module 'library' in shared mode with its database files in directory
+def load_library(directory):
+    os.environ['LIBRARY_SHARED_STORE'] = '1'
+    os.chdir(directory)
+    spec = importlib.util.spec_from_file_location('library', PROGRAM)
+    library = importlib.util.module_from_spec(spec)
+    sys.modules['library'] = library
+    spec.loader.exec_module(library)
+    return library
+
+
+# Child process: creates the user username in the database in directory
+def create_user(directory, username):
+    library = load_library(directory)
+    library.store.put_user(library.User(username, "Reader123!", "customer", "customer900", "bob@email.com"),
+                           'add_user')
+    library.store.close()
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix='library-shared-users-')
+    library = load_library(directory)
+    cache = library.user_cache
+
+    directory_before = cache.get()
+    customer = directory_before.get('customer')
+    customer.points += 5
+    library.store.put_user(customer, 'update_user')
+    assert cache.get() is directory_before, "a write of this process's own reloaded the users"
+
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), directory, 'bob'], capture_output=True,
+                            text=True)
+    assert result.returncode == 0, (result.stdout, result.stderr)
+    # A local write after the other process's one must not hide it
+    customer.points += 5
+    library.store.put_user(customer, 'update_user')
+    bob = cache.get().get('bob')
+    assert bob is not None, "the user created by the other process was never loaded"
+    assert bob.password == "Reader123!" and bob.customer_id == "customer900"
+    assert cache.get().get('customer').points == 10
+    library.store.close()
+    print("-- a user created by another process is loaded after a local user write. --")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        create_user(sys.argv[1], sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,82 @@
+# Check for the indexed lookups of the storage backends, against databases in a temporary directory.
+# Both backends must answer LibraryStore.find_records and page_records alike, including for writes still
+# in the write-ahead log, and a SQLite file without the indexed columns gets them filled in when opened.
+#
+# Run: python assignment/tests/check_storage.py
+import importlib.util
+import os
+import pickle
+import sqlite3
+import sys
+import tempfile
+
+PROGRAM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '234541D_ASSN.py')
+BOOKS = 500
+
+
+# Imports the program as the module 'library' with its own database files in directory
+def load_library(directory):
+    os.chdir(directory)
+    spec = importlib.util.spec_from_file_location('library', PROGRAM)
+    library = importlib.util.module_from_spec(spec)
+    sys.modules['library'] = library
+    spec.loader.exec_module(library)
+    return library
+
+
+def fill(library, store):
+    store.put_books([library.Book(isbn, f"Title {isbn % 97:03d}", f"Publisher {isbn % 7}", "en", 1, True, "Author",
+                                  "Genre", 1) for isbn in range(1, BOOKS + 1)], 'add')
+    for position in range(30):
+        store.put(f"customer_requests:{position}", library.CustomerRequest(f"customer{position % 3}", "Request"))
+
+
+def lookups(store):
+    return {
+        'publisher': [key for key, _ in store.find_records('book:', 'publisher', "Publisher 3")],
+        'requests': [key for key, _ in store.find_records('customer_requests:', 'customer_id', "customer1")],
+        'title page': [(book.get_title(), book.get_isbn()) for _, book in
+                       store.page_records('book:', 'title', offset=40, limit=25)],
+    }
+
+
+def main():
+    directory = tempfile.mkdtemp(prefix='library-storage-')
+    library = load_library(directory)
+    expected_titles = sorted((f"Title {isbn % 97:03d}", isbn) for isbn in range(1, BOOKS + 1))[40:65]
+
+    results = {}
+    for backend in library.STORAGE_BACKENDS:
+        store = library.LibraryStore(os.path.join(directory, f"{backend}_db"), checkpoint_interval=3600,
+                                     backend=backend)
+        try:
+            fill(library, store)
+            results[backend] = lookups(store)
+        finally:
+            store.close()
+        found = results[backend]
+        assert len(found['publisher']) == len(range(3, BOOKS + 1, 7)), (backend, len(found['publisher']))
+        assert found['requests'] == [f"customer_requests:{position}" for position in range(1, 30, 3)], backend
+        assert found['title page'] == expected_titles, backend
+    assert results['shelve'] == results['sqlite']
+
+    # A SQLite file laid out without the indexed columns, as written before they were added
+    path = os.path.join(directory, 'old_db')
+    conn = sqlite3.connect(f"{path}.sqlite")
+    conn.execute("CREATE TABLE books (isbn INTEGER PRIMARY KEY, record BLOB NOT NULL)")
+    conn.executemany("INSERT INTO books VALUES (?, ?)", [
+        (isbn, pickle.dumps(library.Book(isbn, f"Old {isbn}", "Old Publisher", "en", 1, True, "Author", "Genre", 1)))
+        for isbn in range(1, 11)])
+    conn.commit()
+    conn.close()
+    store = library.LibraryStore(path, backend='sqlite')
+    try:
+        found = [key for key, _ in store.find_records('book:', 'publisher', "Old Publisher")]
+        assert len(found) == 10, found
+    finally:
+        store.close()
+    print("-- shelve and sqlite agree on indexed lookups and pages; an older SQLite file was indexed. --")
+
+
+if __name__ == "__main__":
+    main()